@@ -3,7 +3,7 @@
  * fuyao-server CLI
  * 
  * 用法:
- *   fuyao-server start [--port 8000] [--host 0.0.0.0]
+ *   fuyao-server start [--port 8000] [--host 127.0.0.1] [--workers 1] [--uds <path>]
  *   fuyao-server stop
  *   fuyao-server status
  *   fuyao-server logs
@@ -13,6 +13,7 @@ import { existsSync, readFileSync, writeFileSync, unlinkSync } from "fs";
 import { join, dirname } from "path";
 import { fileURLToPath } from "url";
 import { createServer } from "net";
+import { get as httpGet } from "http";
 
 const __dirname = dirname(fileURLToPath(import.meta.url));
 const ROOT = join(__dirname, "..");
@@ -24,16 +25,31 @@ const LOG_FILE = join(PYTHON_DIR, "server.log");
 const isWindows = process.platform === "win32";
 const USE_SYSTEM_PYTHON = process.env.MY_PLATFORM_USE_SYSTEM_PYTHON === "true";
 
-// exe 路径
-const EXE_PATH = isWindows
-  ? join(PYTHON_DIR, "dist", "fuyao-server.exe")
-  : join(PYTHON_DIR, "dist", "fuyao-server");
+// exe 路径（优先 onedir 版本，无需每次启动解压，冷启动更快）
+const EXE_NAME = isWindows ? "fuyao-server.exe" : "fuyao-server";
+const EXE_CANDIDATES = [
+  join(PYTHON_DIR, "dist", "fuyao-server", EXE_NAME), // onedir
+  join(PYTHON_DIR, "dist", EXE_NAME),                 // onefile
+];
+const EXE_PATH = EXE_CANDIDATES.find((p) => existsSync(p)) || EXE_CANDIDATES[0];
 
 // 检查是否有打包好的 exe
 function hasExe() {
   return existsSync(EXE_PATH);
 }
 
+// 等待服务就绪（服务预热完成后才监听端口）
+async function waitForReady(port, uds, timeoutMs = 10000, intervalMs = 100) {
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    if (await isServerRunning(port, uds)) {
+      return true;
+    }
+    await new Promise((r) => setTimeout(r, intervalMs));
+  }
+  return false;
+}
+
 // 获取 Python 路径
 function getPythonPath() {
   // 优先使用虚拟环境（除非明确指定使用系统 Python）
@@ -62,21 +78,22 @@ function getPythonPath() {
 }
 
 // 使用 exe 启动
-async function startWithExe(port, host) {
+async function startWithExe(port, host, workers, uds) {
   // 检查是否已运行
-  if (await isServerRunning(port)) {
-    console.log(`✓ 服务已在运行 (端口 ${port})`);
+  if (await isServerRunning(port, uds)) {
+    console.log(`✓ 服务已在运行 (${describeListen(port, uds)})`);
     return;
   }
   
   // 检查端口
-  if (!(await isPortAvailable(port))) {
+  if (!uds && !(await isPortAvailable(port))) {
     console.error(`❌ 端口 ${port} 被占用`);
     process.exit(1);
   }
   
   // 启动 exe
-  const child = spawn(EXE_PATH, ["--host", host, "--port", String(port)], {
+  const listenArgs = uds ? ["--uds", uds] : ["--host", host, "--port", String(port)];
+  const child = spawn(EXE_PATH, [...listenArgs, "--workers", String(workers)], {
     cwd: PYTHON_DIR,
     detached: true,
     stdio: ["ignore", "pipe", "pipe"],
@@ -97,16 +114,10 @@ async function startWithExe(port, host) {
   console.log(`✓ 服务启动中... (PID: ${child.pid})`);
   
   // 等待就绪
-  let retries = 10;
-  while (retries > 0) {
-    await new Promise((r) => setTimeout(r, 500));
-    if (await isServerRunning(port)) {
-      console.log(`\n✅ 服务已就绪!`);
-      console.log(`   URL: http://localhost:${port}`);
-      console.log(`   文档: http://localhost:${port}/docs`);
-      return;
-    }
-    retries--;
+  if (await waitForReady(port, uds)) {
+    console.log(`\n✅ 服务已就绪!`);
+    console.log(`   URL: ${describeListen(port, uds)}`);
+    return;
   }
   
   console.log("\n⚠️  服务启动中，请稍后检查: fuyao-server status");
@@ -125,14 +136,41 @@ function isPortAvailable(port) {
   });
 }
 
+// 监听地址描述
+function describeListen(port, uds) {
+  return uds ? `unix:${uds}` : `http://localhost:${port}`;
+}
+
+// 获取 /health 响应（uds 时通过 Unix domain socket），失败返回 null
+function fetchHealth(port = 8000, uds) {
+  return new Promise((resolve) => {
+    const target = uds
+      ? { socketPath: uds, path: "/health" }
+      : { host: "localhost", port, path: "/health" };
+    const req = httpGet({ ...target, timeout: 1000 }, (res) => {
+      let body = "";
+      res.setEncoding("utf-8");
+      res.on("data", (chunk) => (body += chunk));
+      res.on("end", () => {
+        if (res.statusCode !== 200) {
+          resolve(null);
+          return;
+        }
+        try {
+          resolve(JSON.parse(body));
+        } catch {
+          resolve(null);
+        }
+      });
+    });
+    req.on("timeout", () => req.destroy());
+    req.on("error", () => resolve(null));
+  });
+}
+
 // 检查服务是否运行
-async function isServerRunning(port = 8000) {
-  try {
-    const response = await fetch(`http://localhost:${port}/health`);
-    return response.ok;
-  } catch {
-    return false;
-  }
+async function isServerRunning(port = 8000, uds) {
+  return (await fetchHealth(port, uds)) !== null;
 }
 
 // 获取已保存的 PID
@@ -160,14 +198,17 @@ function isProcessRunning(pid) {
 // 启动服务
 async function startServer(options = {}) {
   const port = options.port || 8000;
-  const host = options.host || "0.0.0.0";
+  const host = options.host || "127.0.0.1";
+  const workers = options.workers || 1;
+  // Unix domain socket（与插件共用 FUYAO_PLATFORM_SOCKET）
+  const uds = options.uds || process.env.FUYAO_PLATFORM_SOCKET;
   
   console.log("🚀 启动 fuyao-server...\n");
   
   // 优先检查 exe
   if (hasExe()) {
     console.log(`✓ 使用打包版本: ${EXE_PATH}`);
-    return startWithExe(port, host);
+    return startWithExe(port, host, workers, uds);
   }
   
   // 回退到 Python
@@ -181,13 +222,13 @@ async function startServer(options = {}) {
   console.log(`✓ Python: ${python}`);
   
   // 检查是否已运行
-  if (await isServerRunning(port)) {
-    console.log(`✓ 服务已在运行 (端口 ${port})`);
+  if (await isServerRunning(port, uds)) {
+    console.log(`✓ 服务已在运行 (${describeListen(port, uds)})`);
     return;
   }
   
   // 检查端口
-  if (!(await isPortAvailable(port))) {
+  if (!uds && !(await isPortAvailable(port))) {
     console.error(`❌ 端口 ${port} 被占用，请使用 --port 指定其他端口`);
     process.exit(1);
   }
@@ -195,7 +236,12 @@ async function startServer(options = {}) {
   // 启动服务
   const serverScript = join(PYTHON_DIR, "server.py");
   
-  const child = spawn(python, ["-m", "uvicorn", "server:app", "--host", host, "--port", String(port)], {
+  // Unix socket 由 server.py 自行创建（权限 0600），TCP 直接用 uvicorn
+  const serverArgs = uds
+    ? [serverScript, "--uds", uds, "--workers", String(workers)]
+    : ["-m", "uvicorn", "server:app", "--host", host, "--port", String(port), "--workers", String(workers)];
+  
+  const child = spawn(python, serverArgs, {
     cwd: PYTHON_DIR,
     detached: true,
     stdio: ["ignore", "pipe", "pipe"],
@@ -219,17 +265,14 @@ async function startServer(options = {}) {
   console.log(`✓ 服务启动中... (PID: ${child.pid})`);
   
   // 等待服务就绪
-  let retries = 10;
-  while (retries > 0) {
-    await new Promise((r) => setTimeout(r, 500));
-    if (await isServerRunning(port)) {
-      console.log(`\n✅ 服务已就绪!`);
-      console.log(`   URL: http://localhost:${port}`);
+  if (await waitForReady(port, uds)) {
+    console.log(`\n✅ 服务已就绪!`);
+    console.log(`   URL: ${describeListen(port, uds)}`);
+    if (!uds) {
       console.log(`   文档: http://localhost:${port}/docs`);
-      console.log(`\n💡 现在可以启动 OpenCode 了: opencode`);
-      return;
     }
-    retries--;
+    console.log(`\n💡 现在可以启动 OpenCode 了: opencode`);
+    return;
   }
   
   console.log("\n⚠️  服务启动中，请稍后检查状态: my-platform-server status");
@@ -263,26 +306,21 @@ async function stopServer() {
 }
 
 // 检查状态
-async function checkStatus(port = 8000) {
+async function checkStatus(port = 8000, uds) {
   console.log("📊 服务状态\n");
   
   const pid = getSavedPid();
   const processRunning = pid && isProcessRunning(pid);
-  const serverResponding = await isServerRunning(port);
+  const health = await fetchHealth(port, uds);
+  const serverResponding = health !== null;
   
   console.log(`PID 文件: ${pid || "无"}`);
   console.log(`进程状态: ${processRunning ? "✓ 运行中" : "✗ 未运行"}`);
   console.log(`HTTP 响应: ${serverResponding ? "✓ 正常" : "✗ 无响应"}`);
-  console.log(`端口: ${port}`);
+  console.log(`监听: ${describeListen(port, uds)}`);
   
   if (serverResponding) {
-    try {
-      const response = await fetch(`http://localhost:${port}/health`);
-      const data = await response.json();
-      console.log(`工作目录: ${data.cwd}`);
-    } catch {
-      // 忽略
-    }
+    console.log(`工作目录: ${health.cwd}`);
   }
   
   console.log("");
@@ -317,6 +355,12 @@ function parseArgs(args) {
     } else if (args[i] === "--host" && args[i + 1]) {
       options.host = args[i + 1];
       i++;
+    } else if (args[i] === "--uds" && args[i + 1]) {
+      options.uds = args[i + 1];
+      i++;
+    } else if (args[i] === "--workers" && args[i + 1]) {
+      options.workers = parseInt(args[i + 1], 10);
+      i++;
     } else if (args[i] === "--lines" && args[i + 1]) {
       options.lines = parseInt(args[i + 1], 10);
       i++;
@@ -342,12 +386,16 @@ fuyao-server - 扶摇 Agent 平台 Python 服务管理
 
 选项:
   --port <port>   指定端口 (默认: 8000)
-  --host <host>   指定主机 (默认: 0.0.0.0)
+  --host <host>   指定主机 (默认: 127.0.0.1)
+  --uds <path>    监听 Unix domain socket 而不是 TCP (默认: $FUYAO_PLATFORM_SOCKET)
+  --workers <n>   worker 进程数 (默认: 1)
   --lines <n>     日志行数 (默认: 50)
 
 示例:
   fuyao-server start
   fuyao-server start --port 9000
+  fuyao-server start --workers 4
+  fuyao-server start --uds /tmp/fuyao.sock
   fuyao-server status
   fuyao-server logs --lines 100
 `);
@@ -367,7 +415,7 @@ async function main() {
       await stopServer();
       break;
     case "status":
-      await checkStatus(options.port || 8000);
+      await checkStatus(options.port || 8000, options.uds || process.env.FUYAO_PLATFORM_SOCKET);
       break;
     case "logs":
       showLogs(options.lines || 50);
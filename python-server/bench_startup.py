@@ -0,0 +1,141 @@
+"""
+服务冷启动耗时测试
+
+测量:
+1. import server 耗时（模块导入）
+2. 进程启动到端口可用的耗时（就绪）
+3. 就绪后首个请求的耗时
+
+用法:
+    python bench_startup.py                           # 测试 python server.py
+    python bench_startup.py --exe dist/fuyao-server/fuyao-server
+    python bench_startup.py --runs 5 --port 8765
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    """获取一个空闲端口"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import() -> float:
+    """在新进程中测量 import server 的耗时（毫秒）"""
+    code = (
+        "import time; t = time.perf_counter(); import server; "
+        "print((time.perf_counter() - t) * 1000)"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def request(url: str, body: dict = None, timeout: float = 5.0) -> dict:
+    """发送请求并返回 JSON"""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    req = urllib.request.Request(
+        url,
+        data=data,
+        method="POST" if data is not None else "GET",
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def measure_server(cmd: list[str], port: int, timeout: float) -> dict:
+    """启动服务，测量就绪耗时和首个请求耗时（毫秒）"""
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        cmd + ["--host", "127.0.0.1", "--port", str(port)],
+        cwd=HERE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        health = None
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"服务进程已退出: exit={proc.returncode}")
+            try:
+                health = request(f"{base}/health", timeout=0.5)
+                break
+            except OSError:
+                time.sleep(0.02)
+        if health is None:
+            raise RuntimeError(f"服务在 {timeout}s 内未就绪")
+        ready_ms = (time.perf_counter() - start) * 1000
+
+        t = time.perf_counter()
+        request(f"{base}/local/file/read", {"path": "server.py", "directory": HERE})
+        first_request_ms = (time.perf_counter() - t) * 1000
+
+        return {
+            "ready_ms": ready_ms,
+            "first_request_ms": first_request_ms,
+            "server_startup_ms": health.get("startup_ms"),
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summarize(name: str, values: list[float]) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return f"  {name:<22} -"
+    return (
+        f"  {name:<22} median={statistics.median(values):8.1f}ms  "
+        f"min={min(values):8.1f}ms  max={max(values):8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fuyao-server 冷启动耗时测试")
+    parser.add_argument("--exe", help="测试打包后的可执行文件（默认测试 python server.py）")
+    parser.add_argument("--runs", type=int, default=3, help="重复次数 (默认: 3)")
+    parser.add_argument("--port", type=int, default=0, help="端口 (默认: 随机空闲端口)")
+    parser.add_argument("--timeout", type=float, default=30.0, help="就绪超时秒数")
+    args = parser.parse_args()
+
+    cmd = [os.path.abspath(args.exe)] if args.exe else [sys.executable, "server.py"]
+
+    imports, results = [], []
+    for i in range(args.runs):
+        if not args.exe:
+            imports.append(measure_import())
+        results.append(measure_server(cmd, args.port or free_port(), args.timeout))
+        print(f"  第 {i + 1}/{args.runs} 轮完成")
+
+    print("")
+    print(f"启动耗时 ({' '.join(cmd)}):")
+    if imports:
+        print(summarize("import server", imports))
+    print(summarize("进程启动→就绪", [r["ready_ms"] for r in results]))
+    print(summarize("服务内启动(含预热)", [r["server_startup_ms"] for r in results]))
+    print(summarize("首个请求", [r["first_request_ms"] for r in results]))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,4 +22,5 @@ Write-Host "📦 打包中..."
 python build_exe.py
 
 Write-Host ""
-Write-Host "✅ 完成! 输出: dist\my-platform-server.exe" -ForegroundColor Green
+Write-Host "✅ 完成! 输出: dist\fuyao-server\fuyao-server.exe" -ForegroundColor Green
+Write-Host "   启动耗时测试: python bench_startup.py --exe dist\fuyao-server\fuyao-server.exe"
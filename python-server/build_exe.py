@@ -3,13 +3,15 @@
 
 用法:
     pip install pyinstaller
-    python build_exe.py
+    python build_exe.py             # 默认 onedir，启动最快
+    python build_exe.py --onefile   # 单文件，每次启动需解压到临时目录
 
 输出:
-    dist/my-platform-server.exe  (Windows)
-    dist/my-platform-server      (Linux/Mac)
+    onedir:  dist/fuyao-server/fuyao-server(.exe)
+    onefile: dist/fuyao-server(.exe)
 """
 import PyInstaller.__main__
+import argparse
 import platform
 import os
 
@@ -17,14 +19,25 @@ import os
 APP_NAME = "fuyao-server"
 MAIN_SCRIPT = "server.py"
 
+parser = argparse.ArgumentParser(description="打包 fuyao-server")
+parser.add_argument(
+    "--onefile",
+    action="store_true",
+    help="打包成单个文件（分发方便，但每次启动都要解压，冷启动慢数秒）",
+)
+cli_args = parser.parse_args()
+
 # PyInstaller 参数
 args = [
     MAIN_SCRIPT,
     "--name", APP_NAME,
-    "--onefile",           # 打包成单个文件
+    # onedir 直接从磁盘加载，无需每次解压到临时目录
+    "--onefile" if cli_args.onefile else "--onedir",
     "--console",           # 控制台应用
     "--clean",             # 清理临时文件
-    
+    "--noconfirm",         # 覆盖已有输出目录
+    "--noupx",             # UPX 压缩会拖慢每次加载
+
     # 隐式导入（FastAPI/uvicorn 需要）
     "--hidden-import", "uvicorn.logging",
     "--hidden-import", "uvicorn.loops",
@@ -36,22 +49,31 @@ args = [
     "--hidden-import", "uvicorn.protocols.websockets.auto",
     "--hidden-import", "uvicorn.lifespan",
     "--hidden-import", "uvicorn.lifespan.on",
-    
+    # 多 worker 模式按 "server:app" 导入
+    "--hidden-import", "server",
+
     # 排除不需要的模块（减小体积）
     "--exclude-module", "tkinter",
     "--exclude-module", "matplotlib",
     "--exclude-module", "numpy",
     "--exclude-module", "pandas",
+    "--exclude-module", "pytest",
+    "--exclude-module", "IPython",
 ]
 
 # 运行 PyInstaller
 print(f"🔨 开始打包 {APP_NAME}...")
 print(f"   平台: {platform.system()}")
 print(f"   Python: {platform.python_version()}")
+print(f"   模式: {'onefile' if cli_args.onefile else 'onedir'}")
 print("")
 
 PyInstaller.__main__.run(args)
 
+exe_name = f"{APP_NAME}{'.exe' if platform.system() == 'Windows' else ''}"
+output = exe_name if cli_args.onefile else os.path.join(APP_NAME, exe_name)
+
 print("")
 print("✅ 打包完成!")
-print(f"   输出: dist/{APP_NAME}{'.exe' if platform.system() == 'Windows' else ''}")
+print(f"   输出: dist/{output}")
+print(f"   启动耗时测试: python bench_startup.py --exe dist/{output}")
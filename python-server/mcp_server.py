@@ -4,198 +4,486 @@
 为 OpenCode 提供 MCP 协议接口
 参考: https://modelcontextprotocol.io/
 
+与 server.py 共用同一进程内的 FuyaoAgentSDK / LocalTools / FileSystem 实例
+（以及它们的缓存），除 Agent / Skill / 知识库外，还提供文件读写、搜索、
+命令执行和本地工具运行。长耗时调用会周期性发送进度通知。
+
 使用方式:
 1. 直接运行: python mcp_server.py
 2. 或通过 stdio: python -m mcp_server
 """
 import asyncio
 import json
+import os
+import sys
+import time
 from typing import Any
 
+# 复用 server.py 的全局实例（同一进程、同一份缓存）
+from server import sdk, local_tools, fs, catalog, single_flight, CATALOG_TTL
+
 # MCP SDK (需要安装: pip install mcp)
 try:
     from mcp.server import Server
     from mcp.server.stdio import stdio_server
     from mcp.types import Tool, TextContent, Resource
+    from pydantic import AnyUrl
     HAS_MCP = True
 except ImportError:
     HAS_MCP = False
-    print("警告: MCP SDK 未安装，运行 'pip install mcp' 安装")
-
-
-# 你的 Agent SDK
-class MyAgentSDK:
-    """你的 Agent SDK - 同 server.py"""
-    
-    async def run_agent(self, agent_id: str, task: str, context: dict = None) -> dict:
-        await asyncio.sleep(0.5)
-        return {
-            "status": "completed",
-            "output": f"Agent [{agent_id}] 执行完成。\n\n任务: {task}",
-        }
-    
-    async def call_skill(self, skill: str, input_data: dict = None) -> dict:
-        await asyncio.sleep(0.3)
-        return {
-            "status": "completed",
-            "output": f"Skill [{skill}] 执行完成。",
-        }
-    
-    async def search_knowledge(self, query: str, limit: int = 5) -> list:
-        return [{"title": f"关于 {query}", "content": f"{query} 的相关内容..."}]
-
-
-sdk = MyAgentSDK()
+    # stdout 是 MCP stdio 通道，提示信息只能写 stderr
+    print("警告: MCP SDK 未安装，运行 'pip install mcp' 安装", file=sys.stderr)
+
+
+# 长耗时工具的进度通知间隔（秒）
+PROGRESS_INTERVAL = 1.0
+
+
+def _directory(arguments: dict) -> str:
+    """工具调用的工作目录，默认为 MCP Server 的当前目录"""
+    return arguments.get("directory") or os.getcwd()
+
+
+def _json_text(data: Any) -> list:
+    """结构化结果统一以 JSON 文本返回"""
+    return [TextContent(type="text", text=json.dumps(data, ensure_ascii=False))]
 
 
 if HAS_MCP:
     # 创建 MCP Server
     server = Server("my-agent-platform")
 
-    @server.list_tools()
-    async def list_tools() -> list[Tool]:
-        """列出可用的 MCP Tools"""
-        return [
-            Tool(
-                name="run_agent",
-                description="调用我的平台上的 Agent 执行任务",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "agent_id": {
-                            "type": "string",
-                            "description": "Agent ID，如: coder, reviewer, architect",
-                        },
-                        "task": {
-                            "type": "string",
-                            "description": "要执行的任务描述",
-                        },
+    _DIRECTORY_SCHEMA = {
+        "type": "string",
+        "description": "工作目录（默认为 MCP Server 当前目录）",
+    }
+
+    # 工具定义只构建一次
+    TOOLS = [
+        Tool(
+            name="run_agent",
+            description="调用我的平台上的 Agent 执行任务",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "agent_id": {
+                        "type": "string",
+                        "description": "Agent ID，如: coder, reviewer, architect",
+                    },
+                    "task": {
+                        "type": "string",
+                        "description": "要执行的任务描述",
+                    },
+                    "context": {
+                        "type": "object",
+                        "description": "额外上下文",
                     },
-                    "required": ["agent_id", "task"],
+                    "directory": _DIRECTORY_SCHEMA,
                 },
-            ),
-            Tool(
-                name="call_skill",
-                description="调用我的平台上的 Skill",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "skill": {
-                            "type": "string",
-                            "description": "Skill 名称",
-                        },
-                        "input": {
-                            "type": "object",
-                            "description": "Skill 输入参数",
-                        },
+                "required": ["agent_id", "task"],
+            },
+        ),
+        Tool(
+            name="call_skill",
+            description="调用我的平台上的 Skill",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "skill": {
+                        "type": "string",
+                        "description": "Skill 名称",
+                    },
+                    "input": {
+                        "type": "object",
+                        "description": "Skill 输入参数",
                     },
-                    "required": ["skill"],
+                    "target_files": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "目标文件",
+                    },
+                    "directory": _DIRECTORY_SCHEMA,
                 },
-            ),
-            Tool(
-                name="search_knowledge",
-                description="搜索我的平台知识库",
-                inputSchema={
-                    "type": "object",
-                    "properties": {
-                        "query": {
-                            "type": "string",
-                            "description": "搜索关键词",
-                        },
-                        "limit": {
-                            "type": "integer",
-                            "description": "返回结果数量",
-                            "default": 5,
-                        },
+                "required": ["skill"],
+            },
+        ),
+        Tool(
+            name="search_knowledge",
+            description="搜索我的平台知识库",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "搜索关键词",
                     },
-                    "required": ["query"],
+                    "category": {
+                        "type": "string",
+                        "enum": ["docs", "code", "practices", "all"],
+                        "default": "all",
+                    },
+                    "limit": {
+                        "type": "integer",
+                        "description": "返回结果数量",
+                        "default": 5,
+                    },
+                },
+                "required": ["query"],
+            },
+        ),
+        Tool(
+            name="read_file",
+            description="读取本地文件",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "文件路径（相对或绝对）"},
+                    "encoding": {"type": "string", "default": "utf-8"},
+                    "directory": _DIRECTORY_SCHEMA,
+                },
+                "required": ["path"],
+            },
+        ),
+        Tool(
+            name="write_file",
+            description="写入本地文件",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "path": {"type": "string", "description": "文件路径"},
+                    "content": {"type": "string", "description": "文件内容"},
+                    "encoding": {"type": "string", "default": "utf-8"},
+                    "directory": _DIRECTORY_SCHEMA,
+                },
+                "required": ["path", "content"],
+            },
+        ),
+        Tool(
+            name="search_files",
+            description="在本地文件中搜索内容，返回匹配的文件列表",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "pattern": {"type": "string", "description": "搜索内容"},
+                    "include": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "包含的文件模式，如 *.py",
+                    },
+                    "exclude": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "排除的文件模式",
+                    },
+                    "directory": _DIRECTORY_SCHEMA,
+                },
+                "required": ["pattern"],
+            },
+        ),
+        Tool(
+            name="list_files",
+            description="列出目录下的文件",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "pattern": {"type": "string", "default": "*"},
+                    "recursive": {"type": "boolean", "default": True},
+                    "directory": _DIRECTORY_SCHEMA,
+                },
+            },
+        ),
+        Tool(
+            name="run_command",
+            description="执行本地命令",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "command": {"type": "string", "description": "命令"},
+                    "args": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "命令参数",
+                    },
+                    "env": {
+                        "type": "object",
+                        "additionalProperties": {"type": "string"},
+                    },
+                    "timeout": {"type": "integer", "default": 60, "description": "超时秒数"},
+                    "cpu_limit": {"type": "integer", "description": "CPU 时间上限（秒）"},
+                    "memory_limit_mb": {"type": "integer", "description": "内存上限（MB）"},
+                    "directory": _DIRECTORY_SCHEMA,
                 },
+                "required": ["command"],
+            },
+        ),
+        Tool(
+            name="run_tool",
+            description=(
+                "运行预定义的本地工具: "
+                + ", ".join(local_tools.tool_commands.keys())
             ),
-        ]
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "tool": {"type": "string", "description": "工具名称"},
+                    "target": {"type": "string", "description": "目标文件/目录"},
+                    "options": {"type": "object", "description": "额外命令行选项"},
+                    "directory": _DIRECTORY_SCHEMA,
+                },
+                "required": ["tool"],
+            },
+        ),
+    ]
 
-    @server.call_tool()
-    async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
-        """执行 MCP Tool"""
-        if name == "run_agent":
-            result = await sdk.run_agent(
+    async def with_progress(coro, label: str):
+        """
+        执行长耗时调用，期间按 PROGRESS_INTERVAL 发送进度通知
+
+        客户端未提供 progressToken 时直接等待结果。
+        """
+        ctx = server.request_context
+        token = ctx.meta.progressToken if ctx.meta else None
+        if token is None:
+            return await coro
+
+        start = time.monotonic()
+        task = asyncio.ensure_future(coro)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=PROGRESS_INTERVAL)
+            if done:
+                break
+            elapsed = time.monotonic() - start
+            await ctx.session.send_progress_notification(
+                token,
+                elapsed,
+                message=f"{label} 已运行 {elapsed:.0f}s",
+            )
+        return task.result()
+
+    # === 工具实现 ===
+    # 文件操作是同步 IO，放到线程池执行，避免阻塞并发中的其他工具调用
+
+    async def _run_agent(arguments: dict) -> list:
+        result = await with_progress(
+            sdk.run_agent(
                 arguments["agent_id"],
                 arguments["task"],
                 arguments.get("context"),
-            )
-            return [TextContent(type="text", text=result["output"])]
-        
-        elif name == "call_skill":
-            result = await sdk.call_skill(
+                directory=_directory(arguments),
+            ),
+            f"Agent [{arguments['agent_id']}]",
+        )
+        return [TextContent(type="text", text=result["output"])]
+
+    async def _call_skill(arguments: dict) -> list:
+        result = await with_progress(
+            sdk.call_skill(
                 arguments["skill"],
                 arguments.get("input"),
+                arguments.get("target_files"),
+                directory=_directory(arguments),
+            ),
+            f"Skill [{arguments['skill']}]",
+        )
+        return [TextContent(type="text", text=result["output"])]
+
+    async def _search_knowledge(arguments: dict) -> list:
+        items = await sdk.search_knowledge(
+            arguments["query"],
+            arguments.get("category", "all"),
+            arguments.get("limit", 5),
+        )
+        output = "\n\n".join([
+            f"### {item['title']}\n{item['content']}"
+            for item in items
+        ])
+        return [TextContent(type="text", text=output)]
+
+    async def _read_file(arguments: dict) -> list:
+        content = await asyncio.to_thread(
+            fs.read_file,
+            arguments["path"],
+            _directory(arguments),
+            arguments.get("encoding", "utf-8"),
+        )
+        return [TextContent(type="text", text=content)]
+
+    async def _write_file(arguments: dict) -> list:
+        await asyncio.to_thread(
+            fs.write_file,
+            arguments["path"],
+            arguments["content"],
+            _directory(arguments),
+            arguments.get("encoding", "utf-8"),
+        )
+        return _json_text({"path": arguments["path"], "status": "written"})
+
+    async def _search_files(arguments: dict) -> list:
+        files = await asyncio.to_thread(
+            fs.search_files,
+            _directory(arguments),
+            arguments["pattern"],
+            arguments.get("include"),
+            arguments.get("exclude"),
+        )
+        return _json_text({"files": files, "count": len(files)})
+
+    async def _list_files(arguments: dict) -> list:
+        files = await asyncio.to_thread(
+            fs.list_files,
+            _directory(arguments),
+            arguments.get("pattern", "*"),
+            arguments.get("recursive", True),
+        )
+        return _json_text({"files": files, "count": len(files)})
+
+    async def _run_command(arguments: dict) -> list:
+        cmd = [arguments["command"]] + (arguments.get("args") or [])
+        # 任意命令都可能改写文件，之后的只读调用不合并到此前开始的执行
+        with single_flight.writing(_directory(arguments)):
+            result = await with_progress(
+                local_tools.run_command(
+                    cmd,
+                    directory=_directory(arguments),
+                    env=arguments.get("env"),
+                    timeout=arguments.get("timeout", 60),
+                    cpu_limit=arguments.get("cpu_limit"),
+                    memory_limit_mb=arguments.get("memory_limit_mb"),
+                ),
+                f"命令 {arguments['command']}",
             )
-            return [TextContent(type="text", text=result["output"])]
-        
-        elif name == "search_knowledge":
-            items = await sdk.search_knowledge(
-                arguments["query"],
-                arguments.get("limit", 5),
-            )
-            output = "\n\n".join([
-                f"### {item['title']}\n{item['content']}"
-                for item in items
-            ])
-            return [TextContent(type="text", text=output)]
-        
-        else:
+        return _json_text(result)
+
+    async def _run_tool(arguments: dict) -> list:
+        result = await with_progress(
+            local_tools.run_tool(
+                arguments["tool"],
+                target=arguments.get("target"),
+                directory=_directory(arguments),
+                options=arguments.get("options"),
+            ),
+            f"工具 {arguments['tool']}",
+        )
+        return _json_text(result)
+
+    TOOL_HANDLERS = {
+        "run_agent": _run_agent,
+        "call_skill": _call_skill,
+        "search_knowledge": _search_knowledge,
+        "read_file": _read_file,
+        "write_file": _write_file,
+        "search_files": _search_files,
+        "list_files": _list_files,
+        "run_command": _run_command,
+        "run_tool": _run_tool,
+    }
+
+    @server.list_tools()
+    async def list_tools() -> list[Tool]:
+        """列出可用的 MCP Tools"""
+        return TOOLS
+
+    @server.call_tool()
+    async def call_tool(name: str, arguments: dict[str, Any]) -> list[TextContent]:
+        """执行 MCP Tool（每个请求独立调度，可并发执行）"""
+        handler = TOOL_HANDLERS.get(name)
+        if handler is None:
             raise ValueError(f"Unknown tool: {name}")
+        return await handler(arguments)
+
+    # === 资源 ===
+    # 内容来自 server.py 的 catalog（序列化结果按版本缓存），
+    # 订阅的客户端只在目录版本变化时收到 resources/updated 通知
+
+    RESOURCE_CATALOGS = {
+        "platform://agents": "agents",
+        "platform://skills": "skills",
+    }
+
+    RESOURCES = [
+        Resource(
+            uri="platform://agents",
+            name="可用 Agents",
+            description="我的平台上可用的 Agent 列表",
+            mimeType="application/json",
+        ),
+        Resource(
+            uri="platform://skills",
+            name="可用 Skills",
+            description="我的平台上可用的 Skill 列表",
+            mimeType="application/json",
+        ),
+    ]
+
+    # uri -> 订阅该资源的会话
+    subscriptions: dict[str, set] = {}
 
     @server.list_resources()
     async def list_resources() -> list[Resource]:
         """列出可用的 MCP Resources"""
-        return [
-            Resource(
-                uri="platform://agents",
-                name="可用 Agents",
-                description="我的平台上可用的 Agent 列表",
-                mimeType="application/json",
-            ),
-            Resource(
-                uri="platform://skills",
-                name="可用 Skills",
-                description="我的平台上可用的 Skill 列表",
-                mimeType="application/json",
-            ),
-        ]
+        return RESOURCES
 
     @server.read_resource()
-    async def read_resource(uri: str) -> str:
+    async def read_resource(uri: AnyUrl) -> str:
         """读取 MCP Resource"""
-        if uri == "platform://agents":
-            return json.dumps({
-                "agents": [
-                    {"id": "coder", "name": "代码专家", "description": "编写高质量代码"},
-                    {"id": "reviewer", "name": "代码审查", "description": "审查代码质量"},
-                    {"id": "architect", "name": "架构师", "description": "设计系统架构"},
-                ]
-            }, ensure_ascii=False, indent=2)
-        
-        elif uri == "platform://skills":
-            return json.dumps({
-                "skills": [
-                    {"name": "code-review", "description": "代码审查"},
-                    {"name": "refactor", "description": "代码重构"},
-                    {"name": "test-gen", "description": "测试生成"},
-                ]
-            }, ensure_ascii=False, indent=2)
-        
-        else:
+        name = RESOURCE_CATALOGS.get(str(uri))
+        if name is None:
+            raise ValueError(f"Unknown resource: {uri}")
+        entry = await catalog.get(name)
+        return entry["text"]
+
+    @server.subscribe_resource()
+    async def subscribe_resource(uri: AnyUrl) -> None:
+        """订阅资源变更"""
+        if str(uri) not in RESOURCE_CATALOGS:
             raise ValueError(f"Unknown resource: {uri}")
+        subscriptions.setdefault(str(uri), set()).add(server.request_context.session)
+
+    @server.unsubscribe_resource()
+    async def unsubscribe_resource(uri: AnyUrl) -> None:
+        """取消订阅"""
+        subscriptions.get(str(uri), set()).discard(server.request_context.session)
+
+    async def notify_subscribers(name: str):
+        """目录版本变化时通知订阅者（由 catalog.refresh() 回调，不论是谁触发的刷新）"""
+        uri = f"platform://{name}"
+        for session in list(subscriptions.get(uri, ())):
+            try:
+                await session.send_resource_updated(AnyUrl(uri))
+            except Exception:
+                # 会话已断开
+                subscriptions[uri].discard(session)
+
+    catalog.add_listener(notify_subscribers)
+
+    async def watch_catalog():
+        """定期刷新目录（变化由 notify_subscribers 推送）"""
+        while True:
+            await asyncio.sleep(CATALOG_TTL)
+            try:
+                await catalog.refresh()
+            except Exception as e:
+                print(f"刷新目录失败: {e}", file=sys.stderr)
 
 
 async def main():
     if not HAS_MCP:
-        print("MCP SDK 未安装，无法启动 MCP Server")
+        print("MCP SDK 未安装，无法启动 MCP Server", file=sys.stderr)
         return
-    
-    print("启动 MCP Server...")
-    async with stdio_server() as (read_stream, write_stream):
-        await server.run(read_stream, write_stream, server.create_initialization_options())
+
+    print("启动 MCP Server...", file=sys.stderr)
+    options = server.create_initialization_options()
+    # lowlevel Server 默认不声明订阅能力
+    if options.capabilities.resources:
+        options.capabilities.resources.subscribe = True
+
+    await catalog.refresh()
+    watcher = asyncio.create_task(watch_catalog())
+    try:
+        async with stdio_server() as (read_stream, write_stream):
+            await server.run(read_stream, write_stream, options)
+    finally:
+        watcher.cancel()
 
 
 if __name__ == "__main__":
@@ -7,17 +7,42 @@
 3. 本地命令执行
 4. 本地工具运行
 """
-from fastapi import FastAPI, HTTPException
+import time
+
+# 模块开始加载的时间（需在其他导入之前，用于统计冷启动耗时）
+_PROCESS_START = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Header
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Any
+from contextvars import ContextVar
+from contextlib import asynccontextmanager
+from collections import deque
+from concurrent.futures import Future
+from functools import cached_property
 import asyncio
 import subprocess
+import socket
+import sqlite3
+import tempfile
+import threading
 import os
+import re
+import signal
+import sys
 import json
+import copy
+import contextlib
 import uuid
 from pathlib import Path
+from urllib.parse import quote
+from importlib.util import find_spec
 
-app = FastAPI(title="Fuyao Agent Platform API")
+# 可选编码依赖（未安装时自动降级为 JSON / gzip）
+# 只检测是否存在，首次使用时再导入，减少冷启动耗时
+HAS_MSGPACK = find_spec("msgpack") is not None
+HAS_ZSTD = find_spec("zstandard") is not None
 
 
 # ============ 数据模型 ============
@@ -46,6 +71,7 @@ class SkillExecuteRequest(BaseModel):
     target_files: Optional[list[str]] = None
     context: Optional[dict] = None
     directory: Optional[str] = None
+    stream: bool = False  # code-review 按文件流式返回（NDJSON）
 
 
 class LocalCommandRequest(BaseModel):
@@ -55,6 +81,8 @@ class LocalCommandRequest(BaseModel):
     directory: Optional[str] = None
     env: Optional[dict[str, str]] = None
     timeout: Optional[int] = 60
+    cpu_limit: Optional[int] = None        # CPU 时间上限（秒）
+    memory_limit_mb: Optional[int] = None  # 内存（地址空间）上限（MB）
 
 
 class LocalCommandResponse(BaseModel):
@@ -62,6 +90,8 @@ class LocalCommandResponse(BaseModel):
     stdout: str
     stderr: str
     duration_ms: int
+    rusage: Optional[dict] = None          # user_ms / sys_ms / max_rss_kb / block_in / block_out
+    limit_exceeded: Optional[str] = None   # 因超出上限被终止时为 "cpu"
 
 
 class FileReadRequest(BaseModel):
@@ -69,6 +99,7 @@ class FileReadRequest(BaseModel):
     path: str
     directory: Optional[str] = None  # 基础目录
     encoding: str = "utf-8"
+    raw: bool = False  # 直接返回原始字节（application/octet-stream）
 
 
 class FileWriteRequest(BaseModel):
@@ -95,8 +126,223 @@ class LocalToolRequest(BaseModel):
     options: Optional[dict] = None
 
 
+# ============ 请求合并 ============
+
+class SingleFlight:
+    """
+    合并相同 key 的并发调用：同一时刻只执行一次，其余调用方等待并共享结果
+    
+    只用于幂等操作。结果不缓存，执行结束后下一次调用会重新执行；
+    跟随者拿到的是结果的浅拷贝，可以放心修改顶层字段。
+    
+    写入文件或运行会改写文件的工具时用 writing(path) 推进写入代数，调用方把
+    generation(path) 放进 key：写入之后到来的调用不会合并到写入之前开始的执行。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, Future] = {}
+        self._tasks: dict[tuple, asyncio.Task] = {}
+        self._started: dict[tuple, float] = {}
+        # 写入代数：_changed[p] 为 p 之下（含 p）发生写入的次数，_rewritten[p] 为整个 p 可能被改写的次数
+        self._changed: dict[str, int] = {}
+        self._rewritten: dict[str, int] = {}
+        # 被合并（未重复执行）的调用次数
+        self.coalesced = 0
+    
+    def generation(self, path) -> int:
+        """path（文件或目录）的写入代数：其下有写入、或上级目录被整体改写时增加"""
+        path = Path(path).resolve()
+        with self._lock:
+            return self._changed.get(str(path), 0) + sum(
+                self._rewritten.get(str(parent), 0) for parent in path.parents
+            )
+    
+    @contextlib.contextmanager
+    def writing(self, path):
+        """包住对 path 的写入：开始和结束时各推进一次写入代数（执行中途到来的调用也不合并到旧的执行）"""
+        path = Path(path).resolve()
+        self._bump(path)
+        try:
+            yield
+        finally:
+            self._bump(path)
+    
+    def _bump(self, path: Path):
+        with self._lock:
+            self._rewritten[str(path)] = self._rewritten.get(str(path), 0) + 1
+            for p in (path, *path.parents):
+                self._changed[str(p)] = self._changed.get(str(p), 0) + 1
+    
+    def do(self, key: tuple, fn, *args, **kwargs):
+        """同步版本（线程安全），用于 FileSystem"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            return copy.copy(future.result())
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+    
+    async def run(self, key: tuple, fn, *args, window: float = None, **kwargs):
+        """
+        异步版本，用于 LocalTools；某个调用方取消不影响其他调用方
+        
+        window: 只合并开始不超过该时长（秒）的执行，更早开始的由新的调用重新执行
+        """
+        task = self._tasks.get(key)
+        leader = (
+            task is None or task.done()
+            or (window is not None and time.monotonic() - self._started[key] > window)
+        )
+        if leader:
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            self._started[key] = time.monotonic()
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        
+        result = await asyncio.shield(task)
+        return result if leader else copy.copy(result)
+    
+    def _finish(self, key: tuple, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._started[key]
+        if not task.cancelled():
+            task.exception()  # 所有调用方都已取消时，避免 "exception was never retrieved"
+
+
+single_flight = SingleFlight()
+
+
 # ============ 本地工具类 ============
 
+# 子进程预算：同时运行的本地子进程上限（所有 LocalTools 实例共享）
+MAX_SUBPROCESSES = int(os.environ.get("FUYAO_MAX_SUBPROCESSES", str(max(4, os.cpu_count() or 1))))
+SUBPROCESS_BUDGET = asyncio.Semaphore(MAX_SUBPROCESSES)
+# 子进程资源统计与限制依赖 resource 模块（仅 POSIX；Windows 上不统计、不限制）
+HAS_RUSAGE = find_spec("resource") is not None
+# 每个命令默认的 CPU 时间（秒）和内存（MB，按地址空间计）上限，0 表示不限制
+COMMAND_CPU_LIMIT = int(os.environ.get("FUYAO_COMMAND_CPU_LIMIT", "0"))
+COMMAND_MEMORY_LIMIT_MB = int(os.environ.get("FUYAO_COMMAND_MEMORY_LIMIT_MB", "0"))
+
+
+# 设置 rlimit 后 exec 目标命令：$1 = CPU 秒数，$2 = 地址空间 KB（0 表示不限制）。
+# CPU 软限制触发 SIGXCPU，1 秒后硬限制 SIGKILL（先设软限制：软限制不能高于硬限制）
+_LIMIT_WRAPPER = (
+    'cpu=$1 mem=$2; shift 2; '
+    'if [ "$cpu" != 0 ]; then ulimit -S -t "$cpu" && ulimit -H -t $((cpu + 1)) || exit 126; fi; '
+    'if [ "$mem" != 0 ]; then ulimit -v "$mem" || exit 126; fi; '
+    'exec "$@"'
+)
+
+
+def _limit_command(cmd: list[str], cpu_limit: int, memory_limit_mb: int, directory: str, env: dict) -> list[str]:
+    """
+    给命令套上设置资源限制的 /bin/sh 包装；无限制时原样返回
+    
+    不用 preexec_fn：服务进程里总有其他线程（回收线程、线程池、SQLite），fork 后在子进程里
+    执行 Python 代码并不安全，而且会让 subprocess 无法使用 vfork / posix_spawn。
+    """
+    import errno
+    import shutil
+    
+    if not HAS_RUSAGE or not (cpu_limit or memory_limit_mb):
+        return cmd
+    # 命令不存在时与直接执行一样抛出 FileNotFoundError，而不是由 shell 返回 127
+    program = cmd[0]
+    if os.sep in program:
+        found = os.access(os.path.join(directory or os.getcwd(), program), os.X_OK)
+    else:
+        found = shutil.which(program, path=env.get("PATH")) is not None
+    if not found:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), program)
+    return [
+        "/bin/sh", "-c", _LIMIT_WRAPPER, "sh",
+        str(cpu_limit or 0), str((memory_limit_mb or 0) * 1024), *cmd,
+    ]
+
+
+def _rusage_dict(usage, rss_floor: int = 0) -> Optional[dict]:
+    """
+    os.wait4 返回的 rusage 转为响应字段
+    
+    子进程由服务进程 fork / vfork 而来，内核会把 exec 前（即服务进程）的内存峰值计入子进程的
+    ru_maxrss，所以不超过 rss_floor（启动时服务进程自身的峰值）的值无法区分，记为 None。
+    """
+    if usage is None:
+        return None
+    return {
+        "user_ms": int(usage.ru_utime * 1000),
+        "sys_ms": int(usage.ru_stime * 1000),
+        # Linux 单位为 KB，macOS 为字节
+        "max_rss_kb": (
+            (usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss)
+            if usage.ru_maxrss > rss_floor else None
+        ),
+        "block_in": usage.ru_inblock,
+        "block_out": usage.ru_oublock,
+    }
+
+
+class CommandMetrics:
+    """按命令名累计的执行统计（进程内），用于定位耗 CPU / 内存的工具"""
+    
+    def __init__(self):
+        self.commands: dict[str, dict] = {}
+    
+    def record(self, cmd: list[str], result: dict):
+        name = Path(cmd[0]).name if cmd else "?"
+        m = self.commands.setdefault(name, {
+            "count": 0, "failed": 0, "timeouts": 0, "limit_exceeded": 0,
+            "wall_ms": 0, "max_wall_ms": 0, "user_ms": 0, "sys_ms": 0,
+            "max_rss_kb": 0, "block_in": 0, "block_out": 0,
+        })
+        m["count"] += 1
+        m["failed"] += result["exit_code"] != 0
+        m["timeouts"] += bool(result.get("timed_out"))
+        m["limit_exceeded"] += bool(result.get("limit_exceeded"))
+        m["wall_ms"] += result["duration_ms"]
+        m["max_wall_ms"] = max(m["max_wall_ms"], result["duration_ms"])
+        usage = result.get("rusage")
+        if usage:
+            for key in ("user_ms", "sys_ms", "block_in", "block_out"):
+                m[key] += usage[key]
+            m["max_rss_kb"] = max(m["max_rss_kb"], usage["max_rss_kb"] or 0)
+    
+    def snapshot(self) -> dict:
+        """按 CPU 时间从高到低排列"""
+        return dict(sorted(
+            self.commands.items(),
+            key=lambda kv: -(kv[1]["user_ms"] + kv[1]["sys_ms"]),
+        ))
+
+
+command_metrics = CommandMetrics()
+
+# 不在 git 仓库中（无法取工作区指纹）时，只合并该时长（秒）内开始的执行
+COALESCE_WINDOW = float(os.environ.get("FUYAO_COALESCE_WINDOW", "1"))
+
+# 只读、幂等的工具：相同参数的并发调用合并为一次执行
+COALESCE_TOOLS = {
+    "pytest", "pylint", "mypy", "ruff", "tsc", "eslint",
+    "npm-test", "bun-test", "git-status", "git-diff", "git-log",
+}
+
 class LocalTools:
     """本地工具执行器"""
     
@@ -129,14 +375,26 @@ class LocalTools:
             "git-log": ["git", "log", "--oneline", "-10"],
         }
     
+    @cached_property
+    def sharder(self) -> "TestSharder":
+        """pytest 分片执行器（首次使用时创建）"""
+        return TestSharder(self)
+    
     async def run_command(
         self,
         command: str | list[str],
         directory: str = None,
         env: dict = None,
         timeout: int = 60,
+        cpu_limit: int = None,
+        memory_limit_mb: int = None,
     ) -> dict:
-        """执行本地命令"""
+        """
+        执行本地命令
+        
+        POSIX 上同时返回子进程的 rusage，并可按 cpu_limit（秒）/ memory_limit_mb 限制资源，
+        未指定时使用 FUYAO_COMMAND_CPU_LIMIT / FUYAO_COMMAND_MEMORY_LIMIT_MB。
+        """
         import time
         start_time = time.time()
         
@@ -151,43 +409,142 @@ class LocalTools:
         if env:
             run_env.update(env)
         
-        # 执行命令
+        cpu_limit = COMMAND_CPU_LIMIT if cpu_limit is None else cpu_limit
+        memory_limit_mb = COMMAND_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        
+        # 执行命令（占用一个子进程预算名额）
         try:
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=directory,
-                env=run_env,
-            )
-            
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(),
-                timeout=timeout,
-            )
-            
-            duration_ms = int((time.time() - start_time) * 1000)
-            
-            return {
-                "exit_code": process.returncode,
-                "stdout": stdout.decode("utf-8", errors="replace"),
-                "stderr": stderr.decode("utf-8", errors="replace"),
-                "duration_ms": duration_ms,
+            async with SUBPROCESS_BUDGET:
+                if HAS_RUSAGE:
+                    exit_code, stdout, stderr, usage, timed_out = await self._exec_with_rusage(
+                        _limit_command(cmd, cpu_limit, memory_limit_mb, directory, run_env),
+                        directory, run_env, timeout,
+                    )
+                else:
+                    exit_code, stdout, stderr, usage, timed_out = await self._exec(
+                        cmd, directory, run_env, timeout,
+                    )
+        except Exception as e:
+            # 启动失败（命令不存在等）也计入统计
+            result = {
+                "exit_code": -1,
+                "stdout": "",
+                "stderr": str(e),
+                "duration_ms": int((time.time() - start_time) * 1000),
             }
-        except asyncio.TimeoutError:
-            return {
+            command_metrics.record(cmd, result)
+            return result
+        
+        if timed_out:
+            result = {
                 "exit_code": -1,
                 "stdout": "",
                 "stderr": f"Command timed out after {timeout} seconds",
                 "duration_ms": timeout * 1000,
+                "timed_out": True,
             }
-        except Exception as e:
-            return {
-                "exit_code": -1,
-                "stdout": "",
-                "stderr": str(e),
+        else:
+            result = {
+                "exit_code": exit_code,
+                "stdout": stdout.decode("utf-8", errors="replace"),
+                "stderr": stderr.decode("utf-8", errors="replace"),
                 "duration_ms": int((time.time() - start_time) * 1000),
             }
+        
+        result["rusage"] = usage
+        if cpu_limit and not timed_out and self._cpu_limit_killed(exit_code, usage, cpu_limit):
+            result["limit_exceeded"] = "cpu"
+            result["stderr"] += f"\nCommand exceeded CPU limit of {cpu_limit} seconds"
+        
+        command_metrics.record(cmd, result)
+        return result
+    
+    @staticmethod
+    def _cpu_limit_killed(exit_code: int, usage: Optional[dict], cpu_limit: int) -> bool:
+        """
+        是否因超出 RLIMIT_CPU 被结束
+        
+        SIGXCPU 只来自软限制，直接认定（内核按 tick 计时，可能比测得的 CPU 时间早几毫秒）；
+        SIGKILL（硬限制）和经 shell 转发的 128+SIGXCPU 还要求 CPU 时间接近上限。
+        """
+        if exit_code == -signal.SIGXCPU:
+            return True
+        if exit_code not in (-signal.SIGKILL, 128 + signal.SIGXCPU) or not usage:
+            return False
+        return usage["user_ms"] + usage["sys_ms"] >= (cpu_limit - 0.1) * 1000
+    
+    async def _exec(self, cmd: list[str], directory: str, env: dict, timeout: int):
+        """asyncio 子进程执行（Windows，无 rusage 和资源限制），返回 (exit_code, stdout, stderr, None, timed_out)"""
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=directory,
+            env=env,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+            return process.returncode, stdout, stderr, None, False
+        except asyncio.TimeoutError:
+            # 超时后结束子进程，避免在预算之外继续占用资源
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            return process.returncode, b"", b"", None, True
+    
+    async def _exec_with_rusage(self, cmd: list[str], directory: str, env: dict, timeout: int):
+        """
+        执行子进程并用 os.wait4 回收，拿到它（含其已回收的子进程）的 rusage
+        
+        asyncio 的 child watcher 用 waitpid 回收子进程，rusage 会丢失，
+        所以这里自己 Popen：管道交给事件循环读取，回收放在独立线程里。
+        返回 (exit_code, stdout, stderr, rusage, timed_out)。
+        """
+        import resource
+        
+        loop = asyncio.get_running_loop()
+        rss_floor = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=directory,
+            env=env,
+        )
+        exited = loop.create_future()
+        
+        def reap():
+            try:
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+            except ChildProcessError:
+                process.returncode, usage = -1, None
+            loop.call_soon_threadsafe(exited.set_result, usage)
+        
+        threading.Thread(target=reap, name=f"reap-{process.pid}", daemon=True).start()
+        
+        async def read(pipe) -> bytes:
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), pipe,
+            )
+            try:
+                return await reader.read()
+            finally:
+                transport.close()
+        
+        try:
+            stdout, stderr, usage = await asyncio.wait_for(
+                asyncio.gather(read(process.stdout), read(process.stderr), asyncio.shield(exited)),
+                timeout=timeout,
+            )
+            return process.returncode, stdout, stderr, _rusage_dict(usage, rss_floor), False
+        except asyncio.TimeoutError:
+            # 不用 Popen.kill()：它会先 poll()，可能抢在 reap 线程之前回收子进程
+            if process.returncode is None:
+                os.kill(process.pid, signal.SIGKILL)
+            usage = await exited
+            return process.returncode, b"", b"", _rusage_dict(usage, rss_floor), True
     
     # 工具安装命令映射（可被 OpenCode 的 Bash 工具执行）
     INSTALL_COMMANDS = {
@@ -266,7 +623,36 @@ class LocalTools:
         directory: str = None,
         options: dict = None,
     ) -> dict:
-        """运行预定义的本地工具"""
+        """运行预定义的本地工具（只读工具的相同并发调用合并为一次执行）"""
+        if tool not in COALESCE_TOOLS:
+            # 其余工具可能改写文件（ruff-fix、black、prettier、构建等）
+            with single_flight.writing(directory or os.getcwd()):
+                return await self._run_tool(tool, target, directory, options)
+        resolved = Path(directory or os.getcwd()).resolve()
+        # 写入代数只反映经本服务的写入；工作区指纹覆盖其他途径的改动，
+        # 拿不到指纹时只合并刚开始不久的执行
+        worktree = await git_cache.fingerprint(str(resolved))
+        key = (
+            "tool",
+            tool,
+            target,
+            str(resolved),
+            single_flight.generation(resolved),
+            worktree,
+            json.dumps(options or {}, sort_keys=True, default=str),
+        )
+        return await single_flight.run(
+            key, self._run_tool, tool, target, directory, options,
+            window=None if worktree else COALESCE_WINDOW,
+        )
+    
+    async def _run_tool(
+        self,
+        tool: str,
+        target: str = None,
+        directory: str = None,
+        options: dict = None,
+    ) -> dict:
         # 检查工具是否可用
         check_result = self.check_tool_available(tool)
         if not check_result.get("available"):
@@ -289,6 +675,30 @@ class LocalTools:
                 "duration_ms": 0,
             }
         
+        # options.raw = true 时返回原始输出（不做结构化解析）
+        options = dict(options or {})
+        raw = options.pop("raw", False)
+        
+        # pytest 分片运行：options.shards = N 或 "auto"
+        if tool == "pytest" and options.get("shards"):
+            shards = options.pop("shards")
+            return await self.sharder.run(
+                directory or os.getcwd(),
+                [target] if target else [],
+                shards,
+                command=["pytest", *self._option_args(options)],
+            )
+        
+        # 支持结构化输出的工具解析为紧凑的诊断列表
+        if tool in STRUCTURED_TOOLS and not raw:
+            return await self._run_structured(tool, target, directory, options)
+        
+        # git 状态类工具走缓存快路径
+        if tool in GIT_FAST_TOOLS and not target and not options:
+            result = await git_cache.run(tool, directory or os.getcwd())
+            if result is not None:
+                return result
+        
         cmd = self.tool_commands[tool].copy()
         
         # 添加目标
@@ -296,14 +706,42 @@ class LocalTools:
             cmd.append(target)
         
         # 添加额外选项
-        if options:
-            for key, value in options.items():
-                if value is True:
-                    cmd.append(f"--{key}")
-                elif value is not False and value is not None:
-                    cmd.extend([f"--{key}", str(value)])
+        cmd.extend(self._option_args(options))
         
         return await self.run_command(cmd, directory=directory)
+    
+    async def _run_structured(self, tool: str, target: str, directory: str, options: dict) -> dict:
+        """以机器可读格式运行工具，返回紧凑的结构化诊断"""
+        command, parse = STRUCTURED_TOOLS[tool]
+        with tempfile.TemporaryDirectory(prefix="fuyao-tool-") as tmp:
+            report = Path(tmp, "report.xml")
+            cmd = [arg.format(report=report) for arg in command]
+            if target:
+                cmd.append(target)
+            cmd.extend(self._option_args(options))
+            result = await self.run_command(cmd, directory=directory)
+            try:
+                parsed = parse(result["stdout"], report)
+            except Exception:
+                parsed = None
+        
+        # 工具没有产出可解析的结果、或失败却没有任何诊断（崩溃、参数错误等），原样返回
+        if parsed is None or (result["exit_code"] != 0 and not parsed["diagnostics"]):
+            return result
+        
+        structured = compact_diagnostics(parsed.pop("diagnostics"), directory)
+        return {**result, **structured, **parsed}
+    
+    @staticmethod
+    def _option_args(options: dict = None) -> list[str]:
+        """把 options 转换为命令行参数"""
+        args = []
+        for key, value in (options or {}).items():
+            if value is True:
+                args.append(f"--{key}")
+            elif value is not False and value is not None:
+                args.extend([f"--{key}", str(value)])
+        return args
 
 
 class FileSystem:
@@ -316,19 +754,34 @@ class FileSystem:
             p = Path(base_dir) / p
         return p.resolve()
     
+    # 读取、列出、搜索都是幂等操作：相同参数的并发调用通过 single_flight 只执行一次
+    
     def read_file(self, path: str, base_dir: str = None, encoding: str = "utf-8") -> str:
         """读取文件"""
         full_path = self.resolve_path(path, base_dir)
-        return full_path.read_text(encoding=encoding)
+        key = ("read", str(full_path), single_flight.generation(full_path), encoding)
+        return single_flight.do(key, full_path.read_text, encoding=encoding)
+    
+    def read_bytes(self, path: str, base_dir: str = None) -> bytes:
+        """读取文件原始字节"""
+        full_path = self.resolve_path(path, base_dir)
+        key = ("read_bytes", str(full_path), single_flight.generation(full_path))
+        return single_flight.do(key, full_path.read_bytes)
     
     def write_file(self, path: str, content: str, base_dir: str = None, encoding: str = "utf-8"):
         """写入文件"""
         full_path = self.resolve_path(path, base_dir)
-        full_path.parent.mkdir(parents=True, exist_ok=True)
-        full_path.write_text(content, encoding=encoding)
+        with single_flight.writing(full_path):
+            full_path.parent.mkdir(parents=True, exist_ok=True)
+            full_path.write_text(content, encoding=encoding)
     
     def list_files(self, directory: str, pattern: str = "*", recursive: bool = True) -> list[str]:
         """列出文件"""
+        resolved = Path(directory).resolve()
+        key = ("list", str(resolved), single_flight.generation(resolved), pattern, recursive)
+        return single_flight.do(key, self._list_files, directory, pattern, recursive)
+    
+    def _list_files(self, directory: str, pattern: str, recursive: bool) -> list[str]:
         p = Path(directory)
         if recursive:
             files = list(p.rglob(pattern))
@@ -344,6 +797,24 @@ class FileSystem:
         exclude: list[str] = None,
     ) -> list[str]:
         """搜索文件"""
+        resolved = Path(directory).resolve()
+        key = (
+            "search",
+            str(resolved),
+            single_flight.generation(resolved),
+            pattern,
+            tuple(sorted(set(include or ()))),
+            tuple(sorted(set(exclude or ()))),
+        )
+        return single_flight.do(key, self._search_files, directory, pattern, include, exclude)
+    
+    def _search_files(
+        self,
+        directory: str,
+        pattern: str,
+        include: list[str] = None,
+        exclude: list[str] = None,
+    ) -> list[str]:
         import fnmatch
         
         p = Path(directory)
@@ -376,72 +847,1507 @@ class FileSystem:
         return all_files
 
 
-# ============ 你的 Agent SDK 集成 ============
+# ============ 工具输出解析 ============
 
-class FuyaoAgentSDK:
+# 结构化结果中最多返回的诊断条数（计数仍按全部诊断统计）
+DIAGNOSTICS_LIMIT = int(os.environ.get("FUYAO_DIAGNOSTICS_LIMIT", "200"))
+# tsc 非 pretty 输出：file(line,col): error TS2322: message
+_TSC_DIAGNOSTIC = re.compile(
+    r"^(?:(?P<file>.+?)\((?P<line>\d+),(?P<column>\d+)\): )?"
+    r"(?P<severity>error|warning|message) (?P<code>TS\d+): (?P<message>.*)$"
+)
+
+
+def _diagnostic(file, line, column, code, message, severity) -> dict:
+    return {
+        "file": file,
+        "line": line,
+        "column": column,
+        "code": code,
+        "message": (message or "").strip().split("\n", 1)[0][:300],
+        "severity": severity,
+    }
+
+
+def _parse_ruff(stdout: str, report: Path) -> dict:
+    """ruff check --output-format=json"""
+    return {"diagnostics": [
+        _diagnostic(
+            item["filename"],
+            (item.get("location") or {}).get("row"),
+            (item.get("location") or {}).get("column"),
+            item.get("code") or "syntax-error",
+            item["message"],
+            "error",
+        )
+        for item in json.loads(stdout or "[]")
+    ]}
+
+
+def _parse_eslint(stdout: str, report: Path) -> dict:
+    """eslint --format json"""
+    return {"diagnostics": [
+        _diagnostic(
+            result["filePath"],
+            message.get("line"),
+            message.get("column"),
+            message.get("ruleId") or ("fatal" if message.get("fatal") else None),
+            message["message"],
+            "error" if message.get("severity") == 2 else "warning",
+        )
+        for result in json.loads(stdout or "[]")
+        for message in result.get("messages", [])
+    ]}
+
+
+def _parse_tsc(stdout: str, report: Path) -> dict:
+    """tsc --pretty false：每条诊断一行，缩进的后续行是补充说明"""
+    diagnostics = []
+    for line in stdout.splitlines():
+        match = _TSC_DIAGNOSTIC.match(line)
+        if not match:
+            continue
+        diagnostics.append(_diagnostic(
+            match["file"],
+            int(match["line"]) if match["line"] else None,
+            int(match["column"]) if match["column"] else None,
+            match["code"],
+            match["message"],
+            "info" if match["severity"] == "message" else match["severity"],
+        ))
+    return {"diagnostics": diagnostics}
+
+
+def _parse_pytest(stdout: str, report: Path) -> dict:
+    """pytest --junitxml（xunit1，带 file / line 属性）"""
+    import xml.etree.ElementTree as ET
+    
+    root = ET.parse(report).getroot()
+    suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+    tests = {"total": 0, "failed": 0, "error": 0, "skipped": 0}
+    diagnostics = []
+    for suite in suites:
+        tests["total"] += int(suite.get("tests", 0))
+        tests["skipped"] += int(suite.get("skipped", 0))
+        for case in suite.iter("testcase"):
+            for outcome in ("failure", "error"):
+                node = case.find(outcome)
+                if node is None:
+                    continue
+                tests["failed" if outcome == "failure" else "error"] += 1
+                line = case.get("line")
+                name = f"{case.get('classname', '')}::{case.get('name', '')}".strip(":")
+                diagnostics.append(_diagnostic(
+                    case.get("file"),
+                    int(line) + 1 if line is not None else None,  # junit 中为 0 起始
+                    None,
+                    "failed" if outcome == "failure" else "error",
+                    f"{name}: {node.get('message') or node.text or ''}",
+                    "error",
+                ))
+    tests["passed"] = tests["total"] - tests["failed"] - tests["error"] - tests["skipped"]
+    return {"diagnostics": diagnostics, "tests": tests}
+
+
+# 支持结构化输出的工具：机器可读格式的命令（{report} 为报告文件路径）+ 解析函数
+STRUCTURED_TOOLS = {
+    "ruff": (["ruff", "check", "--output-format=json"], _parse_ruff),
+    "ruff-fix": (["ruff", "check", "--fix", "--output-format=json"], _parse_ruff),
+    "eslint": (["eslint", "--format", "json"], _parse_eslint),
+    "tsc": (["tsc", "--noEmit", "--pretty", "false"], _parse_tsc),
+    "pytest": (["pytest", "-q", "-o", "junit_family=xunit1", "--junitxml={report}"], _parse_pytest),
+}
+
+
+def compact_diagnostics(diagnostics: list[dict], directory: str = None) -> dict:
     """
-    你的 Agent SDK 封装
+    去重、统计并生成紧凑的诊断结果
     
-    现在支持本地上下文：
-    - directory: 当前工作目录
-    - worktree: Git worktree
-    - 可以读写文件、执行命令
+    返回 {stdout, diagnostics, counts}：stdout 为每条诊断一行的文本，
+    diagnostics 中相同的诊断合并并带 count。
+    """
+    base = Path(directory or os.getcwd()).resolve()
+    merged = {}
+    for d in diagnostics:
+        if d["file"]:
+            path = Path(d["file"])
+            if path.is_absolute() and path.is_relative_to(base):
+                d["file"] = path.relative_to(base).as_posix()
+        key = (d["file"], d["line"], d["column"], d["code"], d["message"])
+        if key in merged:
+            merged[key]["count"] += 1
+        else:
+            merged[key] = {**d, "count": 1}
+    
+    unique = sorted(
+        merged.values(),
+        key=lambda d: (d["file"] or "", d["line"] or 0, d["column"] or 0),
+    )
+    counts = {"total": len(diagnostics), "unique": len(unique), "error": 0, "warning": 0, "info": 0}
+    by_code = {}
+    for d in unique:
+        counts[d["severity"]] += d["count"]
+        by_code[d["code"]] = by_code.get(d["code"], 0) + d["count"]
+    counts["files"] = len({d["file"] for d in unique if d["file"]})
+    counts["by_code"] = dict(sorted(by_code.items(), key=lambda kv: -kv[1]))
+    
+    shown = unique[:DIAGNOSTICS_LIMIT]
+    lines = [
+        f"{counts['total']} 个问题（error {counts['error']}, warning {counts['warning']}），"
+        f"涉及 {counts['files']} 个文件"
+    ]
+    for d in shown:
+        location = ":".join(str(x) for x in (d["file"], d["line"], d["column"]) if x is not None)
+        repeat = f" (x{d['count']})" if d["count"] > 1 else ""
+        lines.append(f"{location or '-'}: {d['severity']} {d['code']} {d['message']}{repeat}")
+    if len(unique) > len(shown):
+        lines.append(f"... 另有 {len(unique) - len(shown)} 条未列出")
+    
+    return {
+        "stdout": "\n".join(lines),
+        "diagnostics": shown,
+        "counts": counts,
+        "truncated": len(unique) - len(shown),
+    }
+
+
+# ============ Git 快路径 ============
+
+# 走缓存快路径的工具（仅默认参数调用；带 target / options 时仍直接执行 git）
+GIT_FAST_TOOLS = ("git-status", "git-diff", "git-log")
+
+# 变化文件超过该数量时直接全量 diff
+GIT_DIFF_INCREMENTAL_MAX = 500
+
+_GIT_CHANGE_TYPES = {
+    "M": "modified",
+    "A": "added",
+    "D": "deleted",
+    "R": "renamed",
+    "C": "copied",
+    "T": "typechange",
+    "U": "unmerged",
+    "?": "untracked",
+    "!": "ignored",
+}
+
+
+def _stat_key(path: str) -> Optional[tuple]:
+    """文件 stat 指纹，不存在返回 None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class GitCache:
+    """
+    git-status / git-diff / git-log 快路径
+    
+    结果按 .git/index、HEAD、refs 的 stat 以及已跟踪文件（git-status 还包括所有未忽略目录）的 stat 缓存：
+    - 都没变：直接返回缓存，不启动 git 进程
+    - 只有部分工作区文件变化：git-diff 只对这些文件重新计算
+    返回结构化结果（文件列表、变更类型、hunks / 提交列表），
+    同时保留 stdout 文本，兼容原有调用方。
     """
     
+    LOG_LIMIT = 10
+    
     def __init__(self):
-        self.local_tools = LocalTools()
-        self.fs = FileSystem()
+        # 目录 -> 仓库信息（root、git_dir、common_dir 及各类缓存）
+        self._repos: dict[str, dict] = {}
+    
+    async def _git(self, args: list[str], cwd: str) -> tuple[int, bytes, str]:
+        process = await asyncio.create_subprocess_exec(
+            "git", "-c", "core.quotepath=off", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+        )
+        stdout, stderr = await process.communicate()
+        return process.returncode, stdout, stderr.decode("utf-8", errors="replace")
+    
+    async def _repo(self, directory: str) -> Optional[dict]:
+        """定位仓库（每个目录只执行一次 rev-parse）"""
+        key = str(Path(directory).resolve())
+        repo = self._repos.get(key)
+        if repo is not None and os.path.isdir(repo["git_dir"]):
+            return repo
         
-        # 初始化你的 SDK
-        # from your_sdk import YourAgentClient
-        # self.client = YourAgentClient()
+        code, out, _ = await self._git(["rev-parse", "--show-toplevel", "--absolute-git-dir"], key)
+        if code != 0:
+            return None
+        root, git_dir = out.decode("utf-8").splitlines()[:2]
+        
+        # worktree 的 refs 存在公共 git 目录中
+        common_dir = git_dir
+        commondir_file = Path(git_dir) / "commondir"
+        if commondir_file.exists():
+            common_dir = str((Path(git_dir) / commondir_file.read_text().strip()).resolve())
+        
+        # 同一仓库的不同子目录共享缓存
+        for other in self._repos.values():
+            if other["root"] == root:
+                repo = other
+                break
+        else:
+            repo = {"root": root, "git_dir": git_dir, "common_dir": common_dir}
+        self._repos[key] = repo
+        return repo
     
-    async def run_agent(
-        self,
-        agent_id: str,
-        task: str,
-        context: dict = None,
-        directory: str = None,
-        worktree: str = None,
-    ) -> dict:
+    def _index_key(self, repo: dict) -> Optional[tuple]:
+        return _stat_key(os.path.join(repo["git_dir"], "index"))
+    
+    def _refs_key(self, repo: dict) -> tuple:
+        """HEAD 及其指向的 ref 的指纹"""
+        head_path = os.path.join(repo["git_dir"], "HEAD")
+        try:
+            head = Path(head_path).read_text().strip()
+        except OSError:
+            head = ""
+        ref_key = None
+        if head.startswith("ref: "):
+            ref_key = _stat_key(os.path.join(repo["common_dir"], head[5:]))
+        return (
+            head,
+            ref_key,
+            _stat_key(os.path.join(repo["common_dir"], "packed-refs")),
+        )
+    
+    async def _tracked_files(self, repo: dict, index_key: Optional[tuple]) -> list[str]:
+        """已跟踪文件列表（index 不变则复用）"""
+        cached = repo.get("ls_files")
+        if cached and cached["key"] == index_key:
+            return cached["files"]
+        code, out, _ = await self._git(["ls-files", "-z"], repo["root"])
+        files = [f for f in out.decode("utf-8", errors="replace").split("\0") if f] if code == 0 else []
+        repo["ls_files"] = {"key": index_key, "files": files}
+        return files
+    
+    @staticmethod
+    def _snapshot(root: str, files: list[str], ignored_dirs: Optional[set] = None) -> dict:
         """
-        调用你的 Agent 执行任务
+        工作区 stat 快照
         
-        Args:
-            agent_id: Agent ID
-            task: 任务描述
-            context: 额外上下文
-            directory: 当前工作目录（可用于文件操作）
-            worktree: Git worktree 根目录
+        files: 已跟踪文件的 stat；dirs: 目录的 mtime（目录下新增 / 删除文件会改变它）。
+        传入 ignored_dirs 时遍历除 .git 和这些被忽略目录外的所有目录，
+        包括空的、或只含被忽略文件的未跟踪目录——在其中新建文件也会改变 git status；
+        否则只记录已跟踪文件所在的目录（git-diff 不关心未跟踪文件）。
         """
-        # 示例实现 - 替换为你的 SDK 调用
-        # 
-        # result = await self.client.agents.run(
-        #     agent_id=agent_id,
-        #     task=task,
-        #     context={
-        #         **(context or {}),
-        #         "directory": directory,
-        #         "worktree": worktree,
-        #     },
-        # )
+        file_stats = {f: _stat_key(os.path.join(root, f)) for f in files}
+        dir_stats = {}
+        if ignored_dirs is None:
+            dirs = {""}
+            for f in files:
+                parent = os.path.dirname(f)
+                while parent not in dirs:
+                    dirs.add(parent)
+                    parent = os.path.dirname(parent)
+            dir_stats = {d: _stat_key(os.path.join(root, d)) for d in dirs}
+        else:
+            for dirpath, dirnames, _ in os.walk(root):
+                rel = os.path.relpath(dirpath, root).replace(os.sep, "/")
+                rel = "" if rel == "." else rel
+                dir_stats[rel] = _stat_key(dirpath)
+                dirnames[:] = [
+                    d for d in dirnames
+                    if d != ".git" and (f"{rel}/{d}" if rel else d) not in ignored_dirs
+                ]
+        return {"files": file_stats, "dirs": dir_stats}
+    
+    async def _worktree(self, repo: dict, ignored_dirs: Optional[set] = None) -> tuple[Optional[tuple], dict]:
+        index_key = self._index_key(repo)
+        files = await self._tracked_files(repo, index_key)
+        snapshot = await asyncio.to_thread(self._snapshot, repo["root"], files, ignored_dirs)
+        return index_key, snapshot
+    
+    # --- status ---
+    
+    @staticmethod
+    def _parse_status(out: bytes) -> list[dict]:
+        """解析 git status --porcelain=v1 -z"""
+        entries = []
+        parts = out.decode("utf-8", errors="replace").split("\0")
+        i = 0
+        while i < len(parts):
+            item = parts[i]
+            i += 1
+            if len(item) < 4:
+                continue
+            x, y, path = item[0], item[1], item[3:]
+            entry = {"path": path, "index": x, "worktree": y}
+            if x in "RC" and i < len(parts):
+                entry["orig_path"] = parts[i]
+                i += 1
+            if "U" in (x, y) or (x, y) in (("A", "A"), ("D", "D")):
+                entry["change"] = "unmerged"
+            else:
+                entry["change"] = _GIT_CHANGE_TYPES.get(x if x != " " else y, "modified")
+            entries.append(entry)
+        return entries
+    
+    @staticmethod
+    def _format_status(entries: list[dict]) -> str:
+        lines = []
+        for e in entries:
+            path = f"{e['orig_path']} -> {e['path']}" if "orig_path" in e else e["path"]
+            lines.append(f"{e['index']}{e['worktree']} {path}")
+        return "\n".join(lines) + ("\n" if lines else "")
+    
+    async def status(self, repo: dict) -> dict:
+        # 需要上一次 status 给出的被忽略目录才能完整遍历工作区；首次调用只取结果不缓存
+        ignored_dirs = repo.get("ignored_dirs")
+        snapshot = None
+        if ignored_dirs is not None:
+            index_key, snapshot = await self._worktree(repo, ignored_dirs)
+        else:
+            index_key = self._index_key(repo)
+        key = (index_key, self._refs_key(repo))
+        cached = repo.get("status")
+        if cached and snapshot is not None and cached["key"] == key and cached["snapshot"] == snapshot:
+            return {**cached["result"], "cached": True}
         
-        # 模拟执行（包含本地工具调用示例）
-        import time
-        start_time = time.time()
+        code, out, err = await self._git(
+            ["status", "--porcelain=v1", "-z", "--untracked-files=normal", "--ignored=matching"],
+            repo["root"],
+        )
+        if code != 0:
+            return {"exit_code": code, "stdout": "", "stderr": err}
+        entries = []
+        ignored = set()
+        for entry in self._parse_status(out):
+            if entry["index"] == "!":
+                # 整个被忽略的目录以 "dir/" 形式给出，快照不遍历其内部
+                if entry["path"].endswith("/"):
+                    ignored.add(entry["path"].rstrip("/"))
+            else:
+                entries.append(entry)
+        repo["ignored_dirs"] = ignored
+        result = {
+            "exit_code": 0,
+            "stdout": self._format_status(entries),
+            "stderr": "",
+            "files": entries,
+        }
+        # git status 可能刷新 index，重新取指纹
+        if snapshot is not None:
+            repo["status"] = {"key": (self._index_key(repo), key[1]), "snapshot": snapshot, "result": result}
+        return {**result, "cached": False}
+    
+    # --- diff ---
+    
+    @staticmethod
+    def _parse_diff(out: bytes) -> dict[str, dict]:
+        """解析 git diff 输出：path -> {path, change, hunks, patch}"""
+        import re
         
-        output_parts = [f"Agent [{agent_id}] 执行任务:\n{task}\n"]
+        hunk_re = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+        files: dict[str, dict] = {}
+        text = out.decode("utf-8", errors="replace")
         
-        # 示例：如果是代码相关任务，可以运行 lint
-        if directory and agent_id == "coder":
-            output_parts.append("\n--- 代码检查 ---")
-            # 检测项目类型并运行对应工具
-            if (Path(directory) / "package.json").exists():
-                lint_result = await self.local_tools.run_tool("eslint", ".", directory)
-                output_parts.append(f"ESLint: exit={lint_result['exit_code']}")
-            elif (Path(directory) / "pyproject.toml").exists() or (Path(directory) / "setup.py").exists():
-                lint_result = await self.local_tools.run_tool("ruff", ".", directory)
-                output_parts.append(f"Ruff: exit={lint_result['exit_code']}")
+        for chunk in re.split(r"(?m)^(?=diff --git )", text):
+            if not chunk.startswith("diff --git "):
+                continue
+            lines = chunk.splitlines()
+            header = lines[0][len("diff --git "):]
+            old_path = new_path = header.rsplit(" b/", 1)[-1]
+            change = "modified"
+            hunks = []
+            hunk = None
+            for line in lines[1:]:
+                if hunk is None:
+                    if line.startswith("new file mode"):
+                        change = "added"
+                    elif line.startswith("deleted file mode"):
+                        change = "deleted"
+                    elif line.startswith("rename from "):
+                        change = "renamed"
+                        old_path = line[len("rename from "):]
+                    elif line.startswith("rename to "):
+                        new_path = line[len("rename to "):]
+                    elif line.startswith("--- ") and line != "--- /dev/null":
+                        old_path = line[len("--- a/"):]
+                    elif line.startswith("+++ ") and line != "+++ /dev/null":
+                        new_path = line[len("+++ b/"):]
+                match = hunk_re.match(line)
+                if match:
+                    a, b, c, d = match.groups()
+                    hunk = {
+                        "header": line,
+                        "old_start": int(a),
+                        "old_lines": int(b) if b is not None else 1,
+                        "new_start": int(c),
+                        "new_lines": int(d) if d is not None else 1,
+                        "lines": [],
+                    }
+                    hunks.append(hunk)
+                elif hunk is not None:
+                    hunk["lines"].append(line)
+            path = old_path if change == "deleted" else new_path
+            entry = {"path": path, "change": change, "hunks": hunks, "patch": chunk}
+            if change == "renamed":
+                entry["orig_path"] = old_path
+            files[path] = entry
+        return files
+    
+    async def diff(self, repo: dict) -> dict:
+        index_key, snapshot = await self._worktree(repo)
+        cached = repo.get("diff")
+        
+        if cached and cached["key"] == index_key:
+            old_files = cached["snapshot"]["files"]
+            new_files = snapshot["files"]
+            changed = [p for p in new_files.keys() | old_files.keys() if old_files.get(p) != new_files.get(p)]
+            if not changed:
+                return {**cached["result"], "cached": True}
+        else:
+            changed = None
+        
+        if changed is not None and len(changed) <= GIT_DIFF_INCREMENTAL_MAX:
+            # 只对 stat 变化的文件重新 diff（按字面匹配路径：文件名可能以 ":" 开头或含 glob 字符）
+            code, out, err = await self._git(
+                ["--literal-pathspecs", "diff", "--no-color", "--no-ext-diff", "--", *changed], repo["root"],
+            )
+            if code != 0:
+                return {"exit_code": code, "stdout": "", "stderr": err}
+            files = {p: e for p, e in cached["files"].items() if p not in changed}
+            files.update(self._parse_diff(out))
+        else:
+            code, out, err = await self._git(["diff", "--no-color", "--no-ext-diff"], repo["root"])
+            if code != 0:
+                return {"exit_code": code, "stdout": "", "stderr": err}
+            files = self._parse_diff(out)
+        
+        ordered = [files[p] for p in sorted(files)]
+        result = {
+            "exit_code": 0,
+            "stdout": "".join(e["patch"] for e in ordered),
+            "stderr": "",
+            "files": [{k: v for k, v in e.items() if k != "patch"} for e in ordered],
+        }
+        repo["diff"] = {"key": self._index_key(repo), "snapshot": snapshot, "files": files, "result": result}
+        return {**result, "cached": False}
+    
+    # --- log ---
+    
+    async def log(self, repo: dict) -> dict:
+        key = self._refs_key(repo)
+        cached = repo.get("log")
+        if cached and cached["key"] == key:
+            return {**cached["result"], "cached": True}
+        
+        code, out, err = await self._git(
+            ["log", f"-{self.LOG_LIMIT}", "--format=%H%x1f%h%x1f%an%x1f%at%x1f%s"],
+            repo["root"],
+        )
+        if code != 0:
+            return {"exit_code": code, "stdout": "", "stderr": err}
+        commits = []
+        for line in out.decode("utf-8", errors="replace").splitlines():
+            full, short, author, timestamp, subject = line.split("\x1f", 4)
+            commits.append({
+                "hash": full,
+                "short": short,
+                "author": author,
+                "timestamp": int(timestamp),
+                "subject": subject,
+            })
+        result = {
+            "exit_code": 0,
+            "stdout": "".join(f"{c['short']} {c['subject']}\n" for c in commits),
+            "stderr": "",
+            "commits": commits,
+        }
+        repo["log"] = {"key": key, "result": result}
+        return {**result, "cached": False}
+    
+    async def run(self, tool: str, directory: str) -> Optional[dict]:
+        """执行快路径；不在 git 仓库中时返回 None（由调用方回退为直接执行命令）"""
+        start_time = time.time()
+        repo = await self._repo(directory)
+        if repo is None:
+            return None
+        if tool == "git-status":
+            result = await self.status(repo)
+        elif tool == "git-diff":
+            result = await self.diff(repo)
+        else:
+            result = await self.log(repo)
+        result["duration_ms"] = int((time.time() - start_time) * 1000)
+        return result
+    
+    async def fingerprint(self, directory: str) -> Optional[str]:
+        """
+        工作区指纹（index + 文件 stat 快照），不在 git 仓库中时返回 None
+        
+        用于请求合并：通过编辑器、OpenCode 自身的 Edit / Write 等途径改动文件也会改变它。
+        """
+        import hashlib
+        
+        try:
+            repo = await self._repo(directory)
+        except OSError:
+            # 目录不存在、未安装 git
+            return None
+        if repo is None:
+            return None
+        index_key, snapshot = await self._worktree(repo, repo.get("ignored_dirs"))
+        data = json.dumps([index_key, snapshot], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+# ============ 共享状态 ============
+
+def _default_state_dir() -> Path:
+    """
+    当前用户私有的状态目录
+    
+    状态库里有任务、会话和测试基线，不能放在所有用户共享的临时目录：
+    其他用户的服务会因权限不足启动失败，也可能预先创建或篡改库文件。
+    """
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "fuyao-server"
+
+
+# 多 worker 共享的状态库路径（主进程启动 worker 前写入环境变量，worker 继承）
+STATE_DB_PATH = os.environ.get(
+    "FUYAO_STATE_DB",
+    str(_default_state_dir() / "state.db"),
+)
+
+
+class StateStore:
+    """
+    跨 worker 共享状态（SQLite WAL）
+    
+    任务、会话、测试耗时和覆盖映射存在同一个库里，任意 worker 都能处理任意请求。
+    git 快路径缓存、Agent / Skill 目录缓存、请求合并和 /metrics 统计都是进程内的，多 worker 时各自独立。
+    每个线程 / 进程各自持有连接，WAL 模式下读写互不阻塞。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            agent_id TEXT,
+            status TEXT NOT NULL,
+            output TEXT,
+            duration_ms INTEGER,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            name TEXT,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+    
+    def _conn(self) -> sqlite3.Connection:
+        """获取当前线程的连接（首次使用时建库）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 目录仅当前用户可访问
+            Path(self.path).parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+    
+    # --- 任务 ---
+    
+    def create_task(self, task_id: str, agent_id: str):
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO tasks (task_id, agent_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (task_id, agent_id, "running", now, now),
+        )
+    
+    def finish_task(self, task_id: str, status: str, output: str = None, duration_ms: int = None):
+        self._conn().execute(
+            "UPDATE tasks SET status = ?, output = ?, duration_ms = ?, updated_at = ? WHERE task_id = ?",
+            (status, output, duration_ms, time.time(), task_id),
+        )
+    
+    def get_task(self, task_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT task_id, agent_id, status, output, duration_ms FROM tasks WHERE task_id = ?",
+            (task_id,),
+        ).fetchone()
+        return dict(row) if row else None
+    
+    # --- 会话 ---
+    
+    def create_session(self, session_id: str, name: str = None):
+        self._conn().execute(
+            "INSERT INTO sessions (session_id, name, created_at) VALUES (?, ?, ?)",
+            (session_id, name, time.time()),
+        )
+    
+    def list_sessions(self) -> list[dict]:
+        rows = self._conn().execute(
+            "SELECT session_id, name FROM sessions ORDER BY created_at"
+        ).fetchall()
+        return [dict(r) for r in rows]
+    
+    def delete_session(self, session_id: str):
+        self._conn().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+    
+    # --- 缓存（测试耗时、覆盖映射） ---
+    
+    def cache_get(self, namespace: str, key: str) -> Any:
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        ).fetchone()
+        return json.loads(row["value"]) if row else None
+    
+    def cache_set(self, namespace: str, key: str, value: Any):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+
+
+# ============ 测试分片 ============
+
+# 测试运行超时（秒）
+TEST_TIMEOUT = int(os.environ.get("FUYAO_TEST_TIMEOUT", "1800"))
+# test skill 默认分片数（1 = 不分片，"auto" = 子进程预算）
+TEST_SHARDS = os.environ.get("FUYAO_TEST_SHARDS", "1")
+
+
+# pytest 插件：只运行分片内的测试，并记录每个测试的耗时与结果
+_TEST_SHARD_PLUGIN = '''
+import json
+import os
+
+_results = {}
+
+
+def pytest_collection_finish(session):
+    # 仅收集阶段：记录 nodeid 及其文件（相对于当前工作目录，rootdir 可能在上级目录）
+    path = os.environ.get("FUYAO_SHARD_COLLECT")
+    if not path:
+        return
+    cwd = os.getcwd()
+    items = [[item.nodeid, os.path.relpath(str(item.path), cwd).replace(os.sep, "/")] for item in session.items]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f)
+
+
+def pytest_collection_modifyitems(config, items):
+    path = os.environ.get("FUYAO_SHARD_NODEIDS")
+    if not path:
+        return
+    with open(path, encoding="utf-8") as f:
+        wanted = set(json.load(f))
+    selected = [item for item in items if item.nodeid in wanted]
+    deselected = [item for item in items if item.nodeid not in wanted]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def pytest_runtest_logreport(report):
+    entry = _results.setdefault(report.nodeid, {"duration": 0.0, "outcome": "passed"})
+    entry["duration"] += report.duration
+    if report.failed:
+        entry["outcome"] = "failed" if report.when == "call" else "error"
+    elif report.skipped and entry["outcome"] == "passed":
+        entry["outcome"] = "skipped"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    path = os.environ.get("FUYAO_SHARD_REPORT")
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(_results, f)
+'''
+
+
+class TestSharder:
+    """
+    pytest 并行分片
+    
+    按本地记录的历史耗时把测试均衡分到 N 个分片（最长处理时间优先），
+    在子进程预算内并发运行，合并为一份报告（含每个分片的耗时）。
+    """
+    
+    NAMESPACE = "test_durations"
+    # 无历史耗时的测试按该值估算（秒）
+    DEFAULT_DURATION = 0.5
+    
+    def __init__(self, local_tools: LocalTools):
+        self.local_tools = local_tools
+    
+    @staticmethod
+    def shard_count(shards: Any) -> int:
+        """解析分片数："auto" 取子进程预算"""
+        if shards in (None, "", False):
+            return 1
+        if shards == "auto" or shards is True:
+            return MAX_SUBPROCESSES
+        return max(1, min(int(shards), MAX_SUBPROCESSES))
+    
+    async def collect(self, directory: str, targets: list[str], tmp: str, env: dict) -> tuple[dict, dict]:
+        """收集测试，返回 ({nodeid: 相对 directory 的测试文件}, 收集结果)"""
+        collect_file = Path(tmp, "collect.json")
+        result = await self.local_tools.run_command(
+            ["pytest", "-p", "_fuyao_shard_plugin", "--collect-only", "-q", *targets],
+            directory=directory,
+            env={**env, "FUYAO_SHARD_COLLECT": str(collect_file)},
+            timeout=TEST_TIMEOUT,
+        )
+        items = {}
+        if collect_file.exists():
+            items = dict(json.loads(collect_file.read_text(encoding="utf-8")))
+        return items, result
+    
+    def balance(self, nodeids: list[str], durations: dict, shards: int) -> list[list[str]]:
+        """按历史耗时均衡分配，分片内保持收集顺序（复用模块级 fixture）"""
+        import heapq
+        
+        known = [durations[n] for n in nodeids if n in durations]
+        default = sum(known) / len(known) if known else self.DEFAULT_DURATION
+        order = {n: i for i, n in enumerate(nodeids)}
+        
+        heap = [(0.0, i) for i in range(shards)]
+        buckets: list[list[str]] = [[] for _ in range(shards)]
+        for nodeid in sorted(nodeids, key=lambda n: durations.get(n, default), reverse=True):
+            total, index = heapq.heappop(heap)
+            buckets[index].append(nodeid)
+            heapq.heappush(heap, (total + durations.get(nodeid, default), index))
+        return [sorted(b, key=order.__getitem__) for b in buckets if b]
+    
+    async def run(
+        self,
+        directory: str,
+        targets: list[str] = None,
+        shards: Any = "auto",
+        command: list[str] = None,
+        env: dict = None,
+    ) -> dict:
+        """
+        分片运行 pytest
+        
+        command: pytest 命令前缀（默认 ["pytest"]，可替换为 coverage run -m pytest ...）
+        """
+        start_time = time.time()
+        key = str(Path(directory).resolve())
+        command = command or ["pytest"]
+        
+        with tempfile.TemporaryDirectory(prefix="fuyao-shard-") as tmp:
+            Path(tmp, "_fuyao_shard_plugin.py").write_text(_TEST_SHARD_PLUGIN)
+            base_pythonpath = (env or {}).get("PYTHONPATH") or os.environ.get("PYTHONPATH")
+            pythonpath = os.pathsep.join(p for p in (tmp, base_pythonpath) if p)
+            
+            items, collected = await self.collect(
+                directory, targets or [], tmp, {**(env or {}), "PYTHONPATH": pythonpath},
+            )
+            # 收集出错（导入失败等，exit 2/3/4）时直接返回，不能只运行收集成功的部分当作通过
+            if collected["exit_code"] not in (0, 5) or not items:
+                return {**collected, "shards": []}
+            
+            durations = store.cache_get(self.NAMESPACE, key) or {}
+            buckets = self.balance(list(items), durations, self.shard_count(shards))
+            
+            async def run_shard(index: int, bucket: list[str]) -> dict:
+                ids_file = Path(tmp, f"shard-{index}.json")
+                report_file = Path(tmp, f"report-{index}.json")
+                ids_file.write_text(json.dumps(bucket), encoding="utf-8")
+                # 只把分片涉及的测试文件作为参数，减少各分片的收集开销
+                files = list(dict.fromkeys(items[n] for n in bucket))
+                result = await self.local_tools.run_command(
+                    [*command, "-p", "_fuyao_shard_plugin", "-v", *files],
+                    directory=directory,
+                    env={
+                        **(env or {}),
+                        "PYTHONPATH": pythonpath,
+                        "FUYAO_SHARD_NODEIDS": str(ids_file),
+                        "FUYAO_SHARD_REPORT": str(report_file),
+                    },
+                    timeout=TEST_TIMEOUT,
+                )
+                report = {}
+                if report_file.exists():
+                    report = json.loads(report_file.read_text(encoding="utf-8"))
+                return {"index": index, "tests": len(bucket), "result": result, "report": report}
+            
+            shard_runs = await asyncio.gather(*(run_shard(i, b) for i, b in enumerate(buckets)))
+        
+        return self._merge(key, durations, shard_runs, start_time)
+    
+    def _merge(self, key: str, durations: dict, shard_runs: list[dict], start_time: float) -> dict:
+        """合并各分片结果，并更新历史耗时"""
+        summary = {"total": 0, "passed": 0, "failed": 0, "error": 0, "skipped": 0}
+        failed_tests = []
+        shards = []
+        outputs = []
+        exit_codes = []
+        
+        for run in shard_runs:
+            result, report = run["result"], run["report"]
+            counts = {"passed": 0, "failed": 0, "error": 0, "skipped": 0}
+            for nodeid, entry in report.items():
+                counts[entry["outcome"]] += 1
+                durations[nodeid] = round(entry["duration"], 4)
+                if entry["outcome"] in ("failed", "error"):
+                    failed_tests.append(nodeid)
+            for name, value in counts.items():
+                summary[name] += value
+            summary["total"] += run["tests"]
+            exit_codes.append(result["exit_code"])
+            shards.append({
+                "index": run["index"],
+                "tests": run["tests"],
+                "exit_code": result["exit_code"],
+                "duration_ms": result["duration_ms"],
+                "rusage": result.get("rusage"),
+                **counts,
+            })
+            # 只保留未通过分片的完整输出
+            if result["exit_code"] not in (0, 5):
+                outputs.append(f"===== shard {run['index']} (exit={result['exit_code']}) =====\n{result['stdout']}")
+        
+        store.cache_set(self.NAMESPACE, key, durations)
+        
+        failures = [c for c in exit_codes if c not in (0, 5)]
+        exit_code = failures[0] if failures else (0 if summary["total"] else 5)
+        header = (
+            f"{len(shards)} shards: {summary['passed']} passed, {summary['failed']} failed, "
+            f"{summary['error']} errors, {summary['skipped']} skipped"
+        )
+        return {
+            "exit_code": exit_code,
+            "stdout": "\n\n".join([header, *outputs]),
+            "stderr": "\n".join(r["result"]["stderr"] for r in shard_runs if r["result"]["stderr"]),
+            "duration_ms": int((time.time() - start_time) * 1000),
+            "summary": summary,
+            "failed_tests": sorted(failed_tests),
+            "shards": shards,
+            "rusage": self._sum_rusage([s["rusage"] for s in shards]),
+        }
+    
+    @staticmethod
+    def _sum_rusage(usages: list) -> Optional[dict]:
+        """各分片资源使用合计（CPU、I/O 求和，峰值内存取最大）"""
+        usages = [u for u in usages if u]
+        if not usages:
+            return None
+        total = {key: sum(u[key] for u in usages) for key in ("user_ms", "sys_ms", "block_in", "block_out")}
+        total["max_rss_kb"] = max((u["max_rss_kb"] for u in usages if u["max_rss_kb"]), default=None)
+        return total
+
+
+# ============ 测试影响分析 ============
+
+# 覆盖映射超过该时长（秒）视为过期，回退全量运行
+TEST_IMPACT_MAX_AGE = float(os.environ.get("FUYAO_TEST_IMPACT_MAX_AGE", str(7 * 24 * 3600)))
+
+# 这些文件变化可能影响所有测试，直接全量运行
+TEST_IMPACT_GLOBAL_FILES = ("conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "setup.py", "tox.ini")
+
+# 扫描测试文件时跳过的目录
+_TEST_SCAN_SKIP_DIRS = {
+    ".git", ".venv", "venv", "node_modules", "__pycache__", ".tox", ".nox",
+    "build", "dist", ".mypy_cache", ".pytest_cache", ".ruff_cache",
+}
+
+# pytest 插件：每个测试开始时把 coverage 上下文切换为其 nodeid
+# pytest 的 nodeid 相对于 rootdir（可能是上级目录，如上级有 pytest.ini），
+# 这里改写为相对于当前工作目录（即 directory），映射和选择运行都用这种形式。
+# 模块级代码只在首次导入时执行一次，记在空上下文里、无法归到具体测试，
+# 所以同时记录导入关系（已导入的模块再次 import 也会经过 __import__），写到 FUYAO_TIA_IMPORTS 目录
+_TEST_IMPACT_PLUGIN = '''
+import builtins
+import json
+import os
+import sys
+from importlib.util import resolve_name
+
+import coverage
+
+_import = builtins.__import__
+_edges = {}
+
+
+def _tracking_import(name, globals=None, locals=None, fromlist=(), level=0):
+    module = _import(name, globals, locals, fromlist, level)
+    caller = globals.get("__file__") if globals else None
+    if caller:
+        try:
+            full = resolve_name("." * level + name, globals.get("__package__")) if level else name
+        except (ImportError, ValueError):
+            return module
+        names = _edges.setdefault(caller, set())
+        parts = full.split(".")
+        names.update(".".join(parts[:i]) for i in range(1, len(parts) + 1))
+        names.update(full + "." + item for item in fromlist or () if item != "*")
+    return module
+
+
+# 在插件导入时（早于 conftest）开始记录
+builtins.__import__ = _tracking_import
+
+
+def _relative(path):
+    try:
+        rel = os.path.relpath(os.path.abspath(path), os.getcwd())
+    except ValueError:
+        return None
+    return None if rel.startswith("..") else rel.replace(os.sep, "/")
+
+
+def pytest_unconfigure(config):
+    builtins.__import__ = _import
+    directory = os.environ.get("FUYAO_TIA_IMPORTS")
+    if not directory:
+        return
+    edges = {}
+    for caller, names in _edges.items():
+        source = _relative(caller)
+        if source is None:
+            continue
+        targets = set()
+        for name in names:
+            path = getattr(sys.modules.get(name), "__file__", None)
+            target = _relative(path) if path else None
+            if target and target != source:
+                targets.add(target)
+        if targets:
+            edges.setdefault(source, set()).update(targets)
+    with open(os.path.join(directory, "imports-%d.json" % os.getpid()), "w", encoding="utf-8") as f:
+        json.dump({k: sorted(v) for k, v in edges.items()}, f)
+
+
+def pytest_runtest_setup(item):
+    cov = coverage.Coverage.current()
+    if cov is None:
+        return
+    _, sep, rest = item.nodeid.partition("::")
+    path = os.path.relpath(str(item.path), os.getcwd()).replace(os.sep, "/")
+    cov.switch_context(path + sep + rest)
+'''
+
+
+class TestImpact:
+    """
+    测试影响分析（pytest）
+    
+    - 运行测试时用 coverage 记录每个测试触达的文件，加上其测试文件导入的模块，映射存入共享状态库
+    - 以上次全绿时的文件指纹为基线，只运行受变更文件影响的测试
+    - 无映射、映射过期、全局配置变化或上次未通过时回退全量运行
+    """
+    
+    NAMESPACE = "test_impact"
+    
+    def __init__(self, local_tools: LocalTools):
+        self.local_tools = local_tools
+    
+    @staticmethod
+    def _discover_tests(directory: str) -> tuple[list[str], list[str]]:
+        """查找测试文件和各级 conftest.py（相对路径）"""
+        found, conftests = [], []
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in _TEST_SCAN_SKIP_DIRS and not d.endswith(".egg-info")]
+            for name in files:
+                if name == "conftest.py":
+                    conftests.append(Path(root, name).relative_to(directory).as_posix())
+                elif name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py")):
+                    found.append(Path(root, name).relative_to(directory).as_posix())
+        return found, conftests
+    
+    @staticmethod
+    def _is_global(path: str) -> bool:
+        name = path.rsplit("/", 1)[-1]
+        return name in TEST_IMPACT_GLOBAL_FILES or (name.startswith("requirements") and name.endswith(".txt"))
+    
+    @staticmethod
+    def _fingerprint(directory: str, paths: set[str], previous: dict) -> dict:
+        """文件指纹 [mtime_ns, size, sha1]；stat 未变时复用上次的 sha1"""
+        import hashlib
+        
+        result = {}
+        for rel in paths:
+            full = os.path.join(directory, rel)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            old = previous.get(rel)
+            if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                result[rel] = old
+                continue
+            try:
+                digest = hashlib.sha1(Path(full).read_bytes()).hexdigest()
+            except OSError:
+                continue
+            result[rel] = [st.st_mtime_ns, st.st_size, digest]
+        return result
+    
+    def _plan(self, directory: str, state: Optional[dict], mode: str) -> dict:
+        """决定全量还是选择运行，返回 {mode, reason, targets, fingerprint}"""
+        test_files, conftests = self._discover_tests(directory)
+        global_files = conftests + [
+            p for p in os.listdir(directory)
+            if self._is_global(p) and os.path.isfile(os.path.join(directory, p))
+        ]
+        test_map = state["map"] if state else {}
+        import_globals = set((state or {}).get("import_globals") or ())
+        baseline = (state or {}).get("baseline") or {}
+        
+        tracked = set(test_files) | set(global_files) | import_globals
+        for files in test_map.values():
+            tracked.update(files)
+        fingerprint = self._fingerprint(directory, tracked, baseline)
+        
+        def full(reason: str) -> dict:
+            return {"mode": "full", "reason": reason, "targets": [], "fingerprint": fingerprint}
+        
+        if mode == "full":
+            return full("指定全量运行")
+        if not state:
+            return full("无覆盖映射")
+        if time.time() - state["created_at"] > TEST_IMPACT_MAX_AGE:
+            return full("覆盖映射已过期")
+        if not baseline:
+            return full("上次运行未通过")
+        
+        changed = {
+            p for p in tracked | baseline.keys()
+            if (fingerprint.get(p) or [None] * 3)[2] != (baseline.get(p) or [None] * 3)[2]
+        }
+        if any(self._is_global(p) for p in changed):
+            return full("全局配置变化")
+        if changed & import_globals:
+            return full("导入时执行的模块变化")
+        
+        # 变更的测试文件整体运行，其余按覆盖映射选择
+        changed_tests = sorted(p for p in changed if p in test_files)
+        targets = list(changed_tests)
+        for nodeid, files in sorted(test_map.items()):
+            test_file = nodeid.split("::", 1)[0]
+            if test_file in changed_tests:
+                continue
+            if not os.path.isfile(os.path.join(directory, test_file)):
+                if test_file in baseline:
+                    continue  # 测试文件已删除
+                # 无法在 directory 下定位（如旧版本按 rootdir 记录的映射），不能放心跳过
+                return full("覆盖映射中的测试无法定位")
+            if test_file not in test_files and test_file in changed:
+                # 不符合 test_*.py 命名的测试文件（自定义 python_files）
+                targets.append(test_file)
+                changed_tests.append(test_file)
+            elif changed.intersection(files):
+                targets.append(nodeid)
+        
+        return {
+            "mode": "impact",
+            "reason": f"{len(changed)} 个文件变化",
+            "targets": targets,
+            "fingerprint": fingerprint,
+        }
+    
+    async def _run_pytest(self, directory: str, targets: list[str], shards: int) -> tuple[dict, Optional[dict]]:
+        """
+        运行 pytest（shards > 1 时分片并行）；安装了 coverage 时同时收集每个测试触达的文件
+        
+        返回 (结果, {"map": nodeid -> 文件, "import_globals": 无法归到测试的导入时文件})
+        """
+        import shutil
+        
+        sharder = self.local_tools.sharder
+        if not shutil.which("coverage"):
+            if shards > 1:
+                return await sharder.run(directory, targets, shards), None
+            result = await self.local_tools.run_command(
+                ["pytest", "-v", *targets], directory=directory, timeout=TEST_TIMEOUT,
+            )
+            return result, None
+        
+        with tempfile.TemporaryDirectory(prefix="fuyao-tia-") as tmp:
+            Path(tmp, "_fuyao_tia_plugin.py").write_text(_TEST_IMPACT_PLUGIN)
+            rcfile = Path(tmp, "coveragerc")
+            rcfile.write_text(
+                "[run]\n"
+                f"data_file = {Path(tmp, '.coverage').as_posix()}\n"
+                f"source = {Path(directory).resolve().as_posix()}\n"
+                "relative_files = True\n"
+                # 分片时每个进程写独立数据文件，结束后合并
+                f"parallel = {shards > 1}\n"
+            )
+            imports_dir = Path(tmp, "imports")
+            imports_dir.mkdir()
+            env = {
+                "PYTHONPATH": os.pathsep.join(p for p in (tmp, os.environ.get("PYTHONPATH")) if p),
+                "FUYAO_TIA_IMPORTS": str(imports_dir),
+            }
+            command = ["coverage", "run", f"--rcfile={rcfile}", "-m", "pytest", "-p", "_fuyao_tia_plugin"]
+            if shards > 1:
+                result = await sharder.run(directory, targets, shards, command=command, env=env)
+                await self.local_tools.run_command(
+                    ["coverage", "combine", f"--rcfile={rcfile}", "-q"], directory=directory,
+                )
+            else:
+                result = await self.local_tools.run_command(
+                    [*command, "-v", *targets], directory=directory, env=env, timeout=TEST_TIMEOUT,
+                )
+            report = Path(tmp, "coverage.json")
+            exported = await self.local_tools.run_command(
+                ["coverage", "json", f"--rcfile={rcfile}", "--show-contexts", "-q", "-o", str(report)],
+                directory=directory,
+            )
+            if exported["exit_code"] != 0 or not report.exists():
+                return result, None
+            data = json.loads(report.read_text(encoding="utf-8"))
+            edges: dict[str, set] = {}
+            for part in imports_dir.glob("imports-*.json"):
+                for source, deps in json.loads(part.read_text(encoding="utf-8")).items():
+                    edges.setdefault(source, set()).update(deps)
+        
+        # nodeid -> 触达的文件；空上下文为导入时执行的代码
+        test_map: dict[str, set] = {}
+        import_time = set()
+        for path, info in data.get("files", {}).items():
+            rel = Path(path).as_posix()
+            for contexts in info.get("contexts", {}).values():
+                for ctx in contexts:
+                    if ctx:
+                        test_map.setdefault(ctx, set()).add(rel)
+                    else:
+                        import_time.add(rel)
+        
+        # 每个测试再加上其测试文件（传递）导入的模块：模块级代码的变化同样影响它
+        closures = {}
+        for nodeid, files in test_map.items():
+            test_file = nodeid.split("::", 1)[0]
+            if test_file not in closures:
+                closures[test_file] = self._import_closure(test_file, edges)
+            files.update(closures[test_file])
+        # 导入时执行、又不在任何测试文件导入链上的（只被 conftest 导入、动态导入等），变化时全量运行
+        reached = set(closures).union(*closures.values())
+        return result, {
+            "map": {k: sorted(v) for k, v in test_map.items()},
+            "import_globals": sorted(import_time - reached),
+        }
+    
+    @staticmethod
+    def _import_closure(start: str, edges: dict[str, set]) -> set[str]:
+        """start 传递导入的所有文件"""
+        seen, stack = set(), [start]
+        while stack:
+            for target in edges.get(stack.pop(), ()):
+                if target not in seen:
+                    seen.add(target)
+                    stack.append(target)
+        return seen
+    
+    async def run(self, directory: str, mode: str = "impact", shards: Any = None) -> dict:
+        """按影响分析运行测试，返回 run_command 结果 + selection 信息"""
+        key = str(Path(directory).resolve())
+        state = store.cache_get(self.NAMESPACE, key)
+        plan = await asyncio.to_thread(self._plan, directory, state, mode)
+        selection = {"mode": plan["mode"], "reason": plan["reason"], "selected": len(plan["targets"])}
+        
+        if plan["mode"] == "impact" and not plan["targets"]:
+            return {
+                "exit_code": 0,
+                "stdout": "没有受影响的测试",
+                "stderr": "",
+                "duration_ms": 0,
+                "selection": selection,
+            }
+        
+        shard_count = TestSharder.shard_count(shards)
+        result, collected = await self._run_pytest(directory, plan["targets"], shard_count)
+        
+        # 更新覆盖映射：全量运行整体替换，选择运行合并
+        # （全量运行但未安装 coverage 时无法建立映射）
+        if collected is not None or plan["mode"] == "impact":
+            full_run = plan["mode"] == "full"
+            test_map = {} if full_run else dict(state["map"])
+            test_map.update((collected or {}).get("map") or {})
+            import_globals = set() if full_run else set(state.get("import_globals") or ())
+            import_globals.update((collected or {}).get("import_globals") or ())
+            
+            # 退出码 0 = 全部通过，5 = 未收集到测试
+            if result["exit_code"] in (0, 5):
+                tracked = set(plan["fingerprint"]) | import_globals
+                for files in test_map.values():
+                    tracked.update(files)
+                baseline = await asyncio.to_thread(
+                    self._fingerprint, directory, tracked, plan["fingerprint"],
+                )
+            else:
+                # 未通过：保留上次全绿基线，下次仍会选中这些变更
+                baseline = state.get("baseline") if plan["mode"] == "impact" else None
+            
+            store.cache_set(self.NAMESPACE, key, {
+                "created_at": time.time() if plan["mode"] == "full" else state["created_at"],
+                "map": test_map,
+                "import_globals": sorted(import_globals),
+                "baseline": baseline,
+            })
+        
+        result["selection"] = selection
+        return result
+
+
+# ============ 代码审查流水线 ============
+
+# 单个分块的字符上限（约 4 字符 / token）
+REVIEW_CHUNK_CHARS = int(os.environ.get("FUYAO_REVIEW_CHUNK_CHARS", "12000"))
+# 单个批次（一次审查调用）的字符预算
+REVIEW_BATCH_CHARS = int(os.environ.get("FUYAO_REVIEW_BATCH_CHARS", "48000"))
+# 同时进行的审查批次数
+REVIEW_CONCURRENCY = int(os.environ.get("FUYAO_REVIEW_CONCURRENCY", "4"))
+
+# 顶层定义的起始行：大文件按这些行切分，尽量不把函数 / 类拆开
+_REVIEW_DEFINITION = (
+    r"(?:@|(?:export\s+)?(?:default\s+)?(?:async\s+)?"
+    r"(?:def|class|function|interface|type|enum|const|let|var|func|fn|impl|struct|pub)\b)"
+)
+_REVIEW_BOUNDARY = re.compile("^" + _REVIEW_DEFINITION)
+# 超大的类再按其中的方法切分
+_REVIEW_NESTED_BOUNDARY = re.compile(r"^\s*" + _REVIEW_DEFINITION)
+# 紧贴在定义之前、应随定义一起切分的行（装饰器、注释）
+_REVIEW_LEADING = ("@", "#", "//", "/*", "*")
+
+
+class ReviewPipeline:
+    """
+    代码审查流水线
+    
+    1. 并发读取所有目标文件
+    2. 大文件按顶层函数 / 类边界切成不超过 chunk_chars 的分块
+    3. 分块按 batch_chars 打包成批次，最多 concurrency 个批次并行审查
+    4. 一个文件的全部分块审查完后立即产出该文件的结果
+    """
+    
+    def __init__(
+        self,
+        fs: "FileSystem",
+        reviewer,
+        chunk_chars: int = REVIEW_CHUNK_CHARS,
+        batch_chars: int = REVIEW_BATCH_CHARS,
+        concurrency: int = REVIEW_CONCURRENCY,
+    ):
+        self.fs = fs
+        # async (batch: list[dict]) -> list[list[str]]，按分块顺序返回审查意见
+        self.reviewer = reviewer
+        self.chunk_chars = chunk_chars
+        self.batch_chars = batch_chars
+        self.concurrency = concurrency
+    
+    @staticmethod
+    def _pack(items: list, size, limit: int) -> list[list]:
+        """按顺序把 items 装入容量为 limit 的组（单项超限时独占一组）"""
+        groups, group, total = [], [], 0
+        for item in items:
+            n = size(item)
+            if group and total + n > limit:
+                groups.append(group)
+                group, total = [], 0
+            group.append(item)
+            total += n
+        if group:
+            groups.append(group)
+        return groups
+    
+    @staticmethod
+    def _blocks(lines: list[str], boundary: re.Pattern) -> list[list[str]]:
+        """在定义起始行处切块，定义前紧贴的装饰器 / 注释归入该定义"""
+        blocks, current = [], []
+        for line in lines:
+            if current and boundary.match(line):
+                head = len(current)
+                while head > 0 and current[head - 1].lstrip().startswith(_REVIEW_LEADING):
+                    head -= 1
+                if head > 0:
+                    blocks.append(current[:head])
+                    current = current[head:]
+            current.append(line)
+        if current:
+            blocks.append(current)
+        return blocks
+    
+    def split(self, content: str) -> list[dict]:
+        """把文件内容切成分块：{start_line, end_line, text}"""
+        # 先按顶层定义切块；超过上限的块按嵌套定义再切，仍超限才按行切分
+        pieces = []
+        for block in self._blocks(content.splitlines(keepends=True), _REVIEW_BOUNDARY):
+            if sum(map(len, block)) <= self.chunk_chars:
+                pieces.append(block)
+                continue
+            for sub in self._blocks(block, _REVIEW_NESTED_BOUNDARY):
+                pieces.extend(self._pack(sub, len, self.chunk_chars))
+        
+        # 再把相邻的块合并到上限以内
+        chunks, start = [], 1
+        for group in self._pack(pieces, lambda p: sum(map(len, p)), self.chunk_chars):
+            lines = [line for piece in group for line in piece]
+            chunks.append({
+                "start_line": start,
+                "end_line": start + len(lines) - 1,
+                "text": "".join(lines),
+            })
+            start += len(lines)
+        return chunks
+    
+    async def review(self, files: list[str], directory: str):
+        """
+        审查文件，按完成顺序逐个产出每个文件的结果
+        
+        结果: {file, chars, chunks, findings} 或 {file, error}
+        """
+        files = list(dict.fromkeys(files))
+        contents = await asyncio.gather(
+            *(asyncio.to_thread(self.fs.read_file, f, directory) for f in files),
+            return_exceptions=True,
+        )
+        
+        results, pending, chunks = {}, {}, []
+        for f, content in zip(files, contents):
+            if isinstance(content, Exception):
+                yield {"file": f, "error": f"读取失败 ({content})"}
+                continue
+            file_chunks = [{**c, "file": f, "index": i} for i, c in enumerate(self.split(content))]
+            result = {"file": f, "chars": len(content), "chunks": len(file_chunks), "findings": []}
+            if not file_chunks:
+                yield result
+                continue
+            results[f] = result
+            # 每个分块一个槽位，保证审查意见按行号顺序排列
+            pending[f] = [None] * len(file_chunks)
+            chunks.extend(file_chunks)
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def run_batch(batch: list[dict]):
+            async with semaphore:
+                try:
+                    return batch, await self.reviewer(batch), None
+                except Exception as e:
+                    return batch, None, e
+        
+        batches = self._pack(chunks, lambda c: len(c["text"]), self.batch_chars)
+        tasks = [asyncio.ensure_future(run_batch(b)) for b in batches]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                batch, reviews, error = await next_done
+                for i, chunk in enumerate(batch):
+                    f = chunk["file"]
+                    if error is not None:
+                        results[f]["error"] = f"审查失败 ({error})"
+                    pending[f][chunk["index"]] = reviews[i] if error is None else []
+                    if all(slot is not None for slot in pending[f]):
+                        result = results.pop(f)
+                        result["findings"] = [x for slot in pending.pop(f) for x in slot]
+                        yield result
+        finally:
+            # 调用方提前停止迭代（如流式连接断开）时取消剩余批次
+            for task in tasks:
+                task.cancel()
+
+
+# ============ 你的 Agent SDK 集成 ============
+
+class FuyaoAgentSDK:
+    """
+    你的 Agent SDK 封装
+    
+    现在支持本地上下文：
+    - directory: 当前工作目录
+    - worktree: Git worktree
+    - 可以读写文件、执行命令
+    """
+    
+    def __init__(self):
+        self.local_tools = LocalTools()
+        self.fs = FileSystem()
+        
+        # 初始化你的 SDK
+        # from your_sdk import YourAgentClient
+        # self.client = YourAgentClient()
+    
+    # 测试影响分析、代码审查只在对应 Skill 被调用时才用到，首次使用时创建
+    
+    @cached_property
+    def test_impact(self) -> "TestImpact":
+        return TestImpact(self.local_tools)
+    
+    @cached_property
+    def review(self) -> "ReviewPipeline":
+        return ReviewPipeline(self.fs, self.review_batch)
+    
+    async def run_agent(
+        self,
+        agent_id: str,
+        task: str,
+        context: dict = None,
+        directory: str = None,
+        worktree: str = None,
+    ) -> dict:
+        """
+        调用你的 Agent 执行任务
+        
+        Args:
+            agent_id: Agent ID
+            task: 任务描述
+            context: 额外上下文
+            directory: 当前工作目录（可用于文件操作）
+            worktree: Git worktree 根目录
+        """
+        # 示例实现 - 替换为你的 SDK 调用
+        # 
+        # result = await self.client.agents.run(
+        #     agent_id=agent_id,
+        #     task=task,
+        #     context={
+        #         **(context or {}),
+        #         "directory": directory,
+        #         "worktree": worktree,
+        #     },
+        # )
+        
+        # 模拟执行（包含本地工具调用示例）
+        import time
+        start_time = time.time()
+        
+        output_parts = [f"Agent [{agent_id}] 执行任务:\n{task}\n"]
+        
+        # 示例：如果是代码相关任务，可以运行 lint
+        if directory and agent_id == "coder":
+            output_parts.append("\n--- 代码检查 ---")
+            # 检测项目类型并运行对应工具
+            if (Path(directory) / "package.json").exists():
+                lint_result = await self.local_tools.run_tool("eslint", ".", directory)
+                output_parts.append(f"ESLint: exit={lint_result['exit_code']}")
+                output_parts.append(lint_result["stdout"][:2000])
+            elif (Path(directory) / "pyproject.toml").exists() or (Path(directory) / "setup.py").exists():
+                lint_result = await self.local_tools.run_tool("ruff", ".", directory)
+                output_parts.append(f"Ruff: exit={lint_result['exit_code']}")
+                output_parts.append(lint_result["stdout"][:2000])
         
         duration_ms = int((time.time() - start_time) * 1000)
         
@@ -470,22 +2376,23 @@ class FuyaoAgentSDK:
         
         # 示例：code-review skill
         if skill == "code-review" and target_files and directory:
-            for f in target_files[:3]:  # 最多处理3个文件
-                try:
-                    content = self.fs.read_file(f, directory)
-                    output_parts.append(f"\n--- {f} ({len(content)} chars) ---")
-                    # 这里调用你的 SDK 进行代码审查
-                    # review = await self.client.skills.review(content)
-                    output_parts.append("审查结果: (示例) 代码结构良好")
-                except Exception as e:
-                    output_parts.append(f"\n--- {f}: 读取失败 ({e}) ---")
+            async for item in self.review.review(target_files, directory):
+                output_parts.append(self.format_review(item))
         
         # 示例：test skill
+        # input.mode: "impact"（默认，只运行受影响的测试）或 "full"
+        # input.shards: 分片数或 "auto"（默认取 FUYAO_TEST_SHARDS）
         elif skill == "test" and directory:
             if (Path(directory) / "package.json").exists():
                 result = await self.local_tools.run_tool("npm-test", directory=directory)
             else:
-                result = await self.local_tools.run_tool("pytest", directory=directory)
+                mode = (input_data or {}).get("mode", "impact")
+                shards = (input_data or {}).get("shards", TEST_SHARDS)
+                result = await self.test_impact.run(directory, mode=mode, shards=shards)
+                selection = result["selection"]
+                output_parts.append(
+                    f"\n测试选择: {selection['mode']} ({selection['reason']}，选中 {selection['selected']} 项)"
+                )
             output_parts.append(f"\n测试结果: exit={result['exit_code']}")
             if result['stdout']:
                 output_parts.append(result['stdout'][:1000])
@@ -495,6 +2402,48 @@ class FuyaoAgentSDK:
             "output": "\n".join(output_parts),
         }
     
+    async def review_batch(self, batch: list[dict]) -> list[list[str]]:
+        """
+        审查一批代码分块，按分块顺序返回每个分块的审查意见
+        
+        分块: {file, start_line, end_line, text}
+        """
+        # 这里调用你的 SDK 进行代码审查
+        # return await self.client.skills.review([c["text"] for c in batch])
+        return [
+            [f"(示例) 第 {c['start_line']}-{c['end_line']} 行: 代码结构良好"]
+            for c in batch
+        ]
+    
+    @staticmethod
+    def format_review(item: dict) -> str:
+        """把单个文件的审查结果格式化为文本"""
+        if "chars" not in item:
+            return f"\n--- {item['file']}: {item['error']} ---"
+        lines = [f"\n--- {item['file']} ({item['chars']} chars, {item['chunks']} 块) ---"]
+        if item.get("error"):
+            lines.append(item["error"])
+        lines.extend(f"审查结果: {finding}" for finding in item["findings"])
+        return "\n".join(lines)
+    
+    async def list_agents(self) -> list:
+        """平台 Agent 列表"""
+        # 替换为你的 SDK 调用
+        return [
+            {"id": "coder", "name": "代码专家", "description": "编写高质量代码"},
+            {"id": "reviewer", "name": "代码审查", "description": "审查代码质量"},
+            {"id": "architect", "name": "架构师", "description": "设计系统架构"},
+        ]
+    
+    async def list_skills(self) -> list:
+        """平台 Skill 列表"""
+        # 替换为你的 SDK 调用
+        return [
+            {"name": "code-review", "description": "代码审查"},
+            {"name": "refactor", "description": "代码重构"},
+            {"name": "test-gen", "description": "测试生成"},
+        ]
+    
     async def search_knowledge(self, query: str, category: str = "all", limit: int = 5) -> list:
         """搜索知识库"""
         # 替换为你的 SDK 调用
@@ -528,10 +2477,521 @@ class FuyaoAgentSDK:
         }
 
 
+# ============ Agent / Skill 目录 ============
+
+# 目录缓存有效期（秒），过期后下次读取时重新从 SDK 拉取
+CATALOG_TTL = float(os.environ.get("FUYAO_CATALOG_TTL", "30"))
+
+
+class PlatformCatalog:
+    """
+    Agent / Skill 目录缓存
+    
+    每个目录缓存序列化后的 JSON 和版本号（内容哈希，多 worker 间一致）：
+    - 内容不变时读取不再重新序列化
+    - HTTP 以版本号作 ETag
+    - MCP 资源订阅只在版本变化时推送：任何调用方触发的刷新（包括 get() 过期时的刷新）
+      发现版本变化都会通知 add_listener 注册的回调
+    """
+    
+    def __init__(self, sdk: "FuyaoAgentSDK"):
+        self.loaders = {
+            "agents": sdk.list_agents,
+            "skills": sdk.list_skills,
+        }
+        # name -> {"version", "text", "body"}
+        self._entries: dict[str, dict] = {}
+        self._refreshed_at = 0.0
+        self._lock = asyncio.Lock()
+        # 目录变化回调 async callback(name)
+        self._listeners: list = []
+    
+    def add_listener(self, callback):
+        """注册目录版本变化的回调"""
+        self._listeners.append(callback)
+    
+    async def refresh(self) -> list[str]:
+        """从 SDK 重新拉取目录，通知回调并返回内容发生变化的目录名"""
+        import hashlib
+        
+        async with self._lock:
+            changed = []
+            for name, loader in self.loaders.items():
+                text = json.dumps({name: await loader()}, ensure_ascii=False, separators=(",", ":"))
+                body = text.encode("utf-8")
+                version = hashlib.sha1(body).hexdigest()[:16]
+                current = self._entries.get(name)
+                if current is None or current["version"] != version:
+                    self._entries[name] = {"version": version, "text": text, "body": body}
+                    changed.append(name)
+            self._refreshed_at = time.monotonic()
+        
+        for name in changed:
+            for callback in list(self._listeners):
+                try:
+                    await callback(name)
+                except Exception as e:
+                    print(f"目录变化通知失败 [{name}]: {e}", file=sys.stderr)
+        return changed
+    
+    def is_stale(self) -> bool:
+        return not self._entries or time.monotonic() - self._refreshed_at > CATALOG_TTL
+    
+    async def get(self, name: str) -> dict:
+        """读取目录缓存（过期时先刷新）"""
+        if name not in self.loaders:
+            raise KeyError(name)
+        if self.is_stale():
+            await self.refresh()
+        return self._entries[name]
+
+
 # 全局实例
 sdk = FuyaoAgentSDK()
+catalog = PlatformCatalog(sdk)
 local_tools = LocalTools()
 fs = FileSystem()
+git_cache = GitCache()
+store = StateStore(STATE_DB_PATH)
+
+# 后台任务引用（避免被 GC 提前回收）
+_background_tasks: set[asyncio.Task] = set()
+
+
+# ============ 响应编码 ============
+
+# 超过该大小（字节）的响应才压缩
+COMPRESS_MIN_SIZE = int(os.environ.get("FUYAO_COMPRESS_MIN_SIZE", "1024"))
+# 超过该大小且客户端支持时改用 zstd（大包下压缩更快）
+ZSTD_MIN_SIZE = int(os.environ.get("FUYAO_ZSTD_MIN_SIZE", str(256 * 1024)))
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+# 支持 MessagePack 协商的路由前缀
+MSGPACK_ROUTE_PREFIXES = ("/local/", "/agents/")
+
+# 当前请求协商出的响应格式："json" 或 "msgpack"
+_response_format: ContextVar[str] = ContextVar("response_format", default="json")
+
+
+def negotiate_format(path: str, accept: str) -> str:
+    """根据路由和 Accept 头选择响应格式"""
+    if not HAS_MSGPACK or not path.startswith(MSGPACK_ROUTE_PREFIXES):
+        return "json"
+    accept = accept.lower()
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return "msgpack"
+    return "json"
+
+
+def parse_accept_encoding(value: str) -> set[str]:
+    """解析 Accept-Encoding，忽略 q=0 的编码"""
+    encodings = set()
+    for item in value.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(name.strip())
+    return encodings
+
+
+def choose_encoding(accepted: set[str], size: int) -> Optional[str]:
+    """按大小阈值选择压缩算法"""
+    if size < COMPRESS_MIN_SIZE:
+        return None
+    if HAS_ZSTD and "zstd" in accepted and size >= ZSTD_MIN_SIZE:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    if HAS_ZSTD and "zstd" in accepted:
+        return "zstd"
+    return None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """压缩响应体"""
+    if encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    import gzip
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class NegotiatedResponse(JSONResponse):
+    """
+    默认响应类：按请求协商结果输出 JSON 或 MessagePack
+    
+    MessagePack 中 bytes 以二进制原样传输，无需 base64
+    """
+    
+    def __init__(self, content: Any, status_code: int = 200, headers: dict = None,
+                 media_type: str = None, background=None):
+        if media_type is None and _response_format.get() == "msgpack":
+            media_type = MSGPACK_MEDIA_TYPES[0]
+        super().__init__(content, status_code, headers, media_type, background)
+    
+    def render(self, content: Any) -> bytes:
+        if self.media_type in MSGPACK_MEDIA_TYPES:
+            import msgpack
+            return msgpack.packb(content, use_bin_type=True)
+        return super().render(content)
+
+
+class ResponseEncodingMiddleware:
+    """
+    ASGI 中间件：协商响应格式并压缩大响应
+    
+    - Accept: application/msgpack → /local/*、/agents/* 返回 MessagePack
+    - Accept-Encoding: gzip / zstd → 超过阈值的响应体压缩后返回
+    流式响应（多个 body 分片）原样透传。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request_headers = {
+            k.decode("latin-1").lower(): v.decode("latin-1")
+            for k, v in scope.get("headers", [])
+        }
+        token = _response_format.set(
+            negotiate_format(scope["path"], request_headers.get("accept", ""))
+        )
+        accepted = parse_accept_encoding(request_headers.get("accept-encoding", ""))
+        
+        if not accepted:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _response_format.reset(token)
+            return
+        
+        start_message = None
+        
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+            
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers = [(k, v) for k, v in start.get("headers", [])]
+            already_encoded = any(k.lower() == b"content-encoding" for k, _ in headers)
+            encoding = None
+            if not message.get("more_body", False) and not already_encoded:
+                encoding = choose_encoding(accepted, len(body))
+            
+            if encoding:
+                body = compress_body(body, encoding)
+                headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+                headers += [
+                    (b"content-encoding", encoding.encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"vary", b"Accept-Encoding"),
+                ]
+                message = {**message, "body": body}
+            
+            await send({**start, "headers": headers})
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _response_format.reset(token)
+
+
+# ============ 准入控制 ============
+
+def _admission_config(name: str, default: str) -> tuple[int, int, float]:
+    """解析 "并发上限,队列长度,最长排队秒数"（如 FUYAO_ADMISSION_HEAVY=8,32,60）"""
+    limit, queue, wait = os.environ.get(f"FUYAO_ADMISSION_{name.upper()}", default).split(",")
+    return int(limit), int(queue), float(wait)
+
+
+# 是否启用准入控制
+ADMISSION_ENABLED = os.environ.get("FUYAO_ADMISSION", "1") != "0"
+# 路由分级：交互式（文件读写等）不会被搜索、构建类请求挤占
+ADMISSION_CLASSES = {
+    "interactive": _admission_config("interactive", "64,256,5"),
+    "search": _admission_config("search", "8,32,30"),
+    "heavy": _admission_config("heavy", f"{MAX_SUBPROCESSES},{MAX_SUBPROCESSES * 4},60"),
+}
+ADMISSION_ROUTES = {
+    "/local/file/search": "search",
+    "/knowledge/search": "search",
+    "/local/command": "heavy",
+    "/local/tool": "heavy",
+    "/skills/execute": "heavy",
+    "/agents/run": "heavy",
+    "/subagents/orchestrate": "heavy",
+}
+# 不受限制的路由（健康检查、统计、文档）
+ADMISSION_EXEMPT = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json")
+# 每个客户端的令牌桶：每秒补充 rate 个，最多积攒 burst 个（rate=0 关闭）
+CLIENT_RATE = float(os.environ.get("FUYAO_CLIENT_RATE", "20"))
+CLIENT_BURST = float(os.environ.get("FUYAO_CLIENT_BURST", "100"))
+
+
+class AdmissionRejected(Exception):
+    """请求被拒绝，retry_after 为建议的重试秒数"""
+    
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class AdmissionGate:
+    """
+    一类路由的并发闸门
+    
+    未超过 limit 时直接放行；否则进入 FIFO 队列等待，队列满或排队超时立即拒绝，
+    不让请求在服务端无限堆积。
+    """
+    
+    def __init__(self, name: str, limit: int, queue: int, wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.active = 0
+        self.waiters = deque()
+        self.rejected = 0
+        # 请求处理耗时的指数滑动平均（秒），用于估算 Retry-After
+        self.avg_seconds = 0.1
+    
+    def retry_after(self) -> float:
+        """按当前排队长度和平均耗时估算多久后有空位"""
+        return self.avg_seconds * (len(self.waiters) + 1) / self.limit
+    
+    def observe(self, seconds: float):
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+    
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue:
+            self.rejected += 1
+            raise AdmissionRejected(503, f"{self.name} 请求过多，队列已满", self.retry_after())
+        
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已转交过来但调用方不再等待（超时 / 断开），继续转交
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise AdmissionRejected(503, f"{self.name} 请求排队超时", self.retry_after())
+            raise
+    
+    def release(self):
+        # 有人排队时直接把名额转交给队首，active 不变
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+    
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "rejected": self.rejected,
+        }
+
+
+class TokenBucket:
+    """令牌桶：take() 成功返回 0，否则返回需要等待的秒数"""
+    
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+    
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """
+    准入控制状态：每类路由一个闸门，每个客户端一个令牌桶
+    
+    - 客户端由 X-Fuyao-Client 头区分，没有时按来源地址（Unix socket 统一为 local）
+    - 超出令牌桶配额返回 429，路由队列满或排队超时返回 503，均带 Retry-After
+    - 状态按进程保存，多 worker 模式下每个 worker 各自计数
+    """
+    
+    def __init__(self):
+        self.gates = {
+            name: AdmissionGate(name, *config)
+            for name, config in ADMISSION_CLASSES.items()
+        }
+        self.buckets: dict[str, TokenBucket] = {}
+        self.throttled = 0
+    
+    def gate(self, path: str) -> AdmissionGate:
+        return self.gates[ADMISSION_ROUTES.get(path, "interactive")]
+    
+    @staticmethod
+    def client_id(scope) -> str:
+        for key, value in scope.get("headers", []):
+            if key == b"x-fuyao-client":
+                return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client and client[0] else "local"
+    
+    def check_quota(self, client: str):
+        if CLIENT_RATE <= 0:
+            return
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            if len(self.buckets) >= 1024:
+                # 丢弃已经攒满的桶（等价于重新创建）
+                now = time.monotonic()
+                self.buckets = {
+                    k: b for k, b in self.buckets.items()
+                    if b.tokens + (now - b.updated) * b.rate < b.burst
+                }
+            bucket = self.buckets[client] = TokenBucket(CLIENT_RATE, CLIENT_BURST)
+        wait = bucket.take()
+        if wait:
+            self.throttled += 1
+            raise AdmissionRejected(429, f"客户端 {client} 请求过于频繁", wait)
+    
+    def stats(self) -> dict:
+        return {
+            "enabled": ADMISSION_ENABLED,
+            "throttled": self.throttled,
+            **{name: gate.stats() for name, gate in self.gates.items()},
+        }
+
+
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """ASGI 中间件：按客户端限速、按路由分级限流（状态见 AdmissionController）"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not ADMISSION_ENABLED or path.startswith(ADMISSION_EXEMPT):
+            await self.app(scope, receive, send)
+            return
+        
+        gate = admission.gate(path)
+        try:
+            admission.check_quota(admission.client_id(scope))
+            await gate.acquire()
+        except AdmissionRejected as e:
+            await self.reject(send, e)
+            return
+        
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.observe(time.monotonic() - start)
+            gate.release()
+    
+    @staticmethod
+    async def reject(send, error: AdmissionRejected):
+        body = json.dumps(
+            {"detail": error.detail, "retry_after": error.retry_after},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": error.status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"retry-after", str(error.retry_after).encode("latin-1")),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+# ============ 启动预热 ============
+
+def warm_up() -> dict:
+    """
+    预热首个请求会用到的模块和代码路径
+    
+    在 lifespan 中执行：uvicorn 在预热完成后才开始监听端口，
+    因此端口可连接即代表路由已就绪。
+    """
+    start = time.perf_counter()
+    
+    # 首次请求才会导入的模块
+    import shutil  # noqa: F401  (check_tool_available)
+    import fnmatch  # noqa: F401  (search_files)
+    import gzip  # noqa: F401  (compress_body)
+    if HAS_MSGPACK:
+        import msgpack  # noqa: F401
+    if HAS_ZSTD:
+        import zstandard  # noqa: F401
+    
+    # 走一遍常用路径（状态库、测试 / 审查子系统在首次使用时才初始化，不在这里预热）
+    fs.resolve_path(".")
+    local_tools.check_tool_available("git-status")
+    NegotiatedResponse({"warm": True})
+    LocalCommandResponse(exit_code=0, stdout="", stderr="", duration_ms=0)
+    
+    return {"warmup_ms": int((time.perf_counter() - start) * 1000)}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    stats = warm_up()
+    # 目录可能要访问平台，放到后台拉取，不阻塞就绪（过期或尚未拉取时 get() 会自行刷新）
+    task = asyncio.create_task(catalog.refresh())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    app.state.ready = True
+    app.state.startup_ms = int((time.perf_counter() - _PROCESS_START) * 1000)
+    print(f"服务就绪: 启动 {app.state.startup_ms}ms (预热 {stats['warmup_ms']}ms)", flush=True)
+    yield
+
+
+app = FastAPI(
+    title="Fuyao Agent Platform API",
+    default_response_class=NegotiatedResponse,
+    lifespan=lifespan,
+)
+app.state.ready = False
+app.add_middleware(ResponseEncodingMiddleware)
+# 最后添加的在最外层：先做准入判断，被拒绝的请求不进入后续处理
+app.add_middleware(AdmissionMiddleware)
 
 
 # ============ API 路由 ============
@@ -539,7 +2999,14 @@ fs = FileSystem()
 @app.get("/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy", "cwd": os.getcwd()}
+    return {
+        "status": "healthy",
+        "cwd": os.getcwd(),
+        "ready": app.state.ready,
+        "startup_ms": getattr(app.state, "startup_ms", None),
+        "admission": admission.stats(),
+        "coalesced": single_flight.coalesced,
+    }
 
 
 # === Agent API ===
@@ -566,20 +3033,84 @@ async def run_agent(request: AgentRunRequest):
                 artifacts=result.get("artifacts"),
             )
         else:
-            asyncio.create_task(sdk.run_agent(
-                request.agent_id,
-                request.task,
-                request.context,
-                directory=request.directory,
-            ))
+            store.create_task(task_id, request.agent_id)
+            task = asyncio.create_task(_run_agent_in_background(task_id, request))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
             return AgentRunResponse(task_id=task_id, status="running")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _run_agent_in_background(task_id: str, request: AgentRunRequest):
+    """后台执行 Agent，结果写入共享状态库"""
+    try:
+        result = await sdk.run_agent(
+            request.agent_id,
+            request.task,
+            request.context,
+            directory=request.directory,
+            worktree=request.worktree,
+        )
+        store.finish_task(task_id, result["status"], result.get("output"), result.get("duration_ms"))
+    except Exception as e:
+        store.finish_task(task_id, "failed", str(e))
+
+
+@app.get("/agents/tasks/{task_id}", response_model=AgentRunResponse)
+async def get_agent_task(task_id: str):
+    """查询后台任务状态（任意 worker 均可查询）"""
+    task = store.get_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Task not found: {task_id}")
+    return AgentRunResponse(
+        task_id=task["task_id"],
+        status=task["status"],
+        output=task["output"],
+        duration_ms=task["duration_ms"],
+    )
+
+
+async def _catalog_response(name: str, if_none_match: Optional[str]) -> Response:
+    """返回缓存的目录 JSON，支持 ETag / 304"""
+    entry = await catalog.get(name)
+    etag = f'"{entry["version"]}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=entry["body"], media_type="application/json", headers={"ETag": etag})
+
+
+@app.get("/agents")
+async def list_agents(if_none_match: Optional[str] = Header(None)):
+    """平台 Agent 列表（插件 fetchAgentsFromPlatform 使用）"""
+    return await _catalog_response("agents", if_none_match)
+
+
+@app.get("/skills")
+async def list_skills(if_none_match: Optional[str] = Header(None)):
+    """平台 Skill 列表"""
+    return await _catalog_response("skills", if_none_match)
+
+
+async def _stream_review(request: SkillExecuteRequest):
+    """code-review 流式输出：每审查完一个文件输出一行 JSON，最后一行为汇总"""
+    files = 0
+    async for item in sdk.review.review(request.target_files, request.directory):
+        files += 1
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+    yield json.dumps({"status": "completed", "files": files}) + "\n"
+
+
 @app.post("/skills/execute")
 async def execute_skill(request: SkillExecuteRequest):
-    """执行 Skill"""
+    """
+    执行 Skill
+    
+    code-review 且 stream=true 时返回 application/x-ndjson，
+    每审查完一个文件输出一行结果。
+    """
+    if request.stream and request.skill == "code-review" and request.target_files and request.directory:
+        return StreamingResponse(_stream_review(request), media_type="application/x-ndjson")
     try:
         result = await sdk.call_skill(
             request.skill,
@@ -598,12 +3129,16 @@ async def execute_skill(request: SkillExecuteRequest):
 async def run_local_command(request: LocalCommandRequest):
     """执行本地命令"""
     cmd = [request.command] + (request.args or [])
-    result = await local_tools.run_command(
-        cmd,
-        directory=request.directory,
-        env=request.env,
-        timeout=request.timeout,
-    )
+    # 任意命令都可能改写文件
+    with single_flight.writing(request.directory or os.getcwd()):
+        result = await local_tools.run_command(
+            cmd,
+            directory=request.directory,
+            env=request.env,
+            timeout=request.timeout,
+            cpu_limit=request.cpu_limit,
+            memory_limit_mb=request.memory_limit_mb,
+        )
     return LocalCommandResponse(**result)
 
 
@@ -619,6 +3154,12 @@ async def run_local_tool(request: LocalToolRequest):
     return result
 
 
+@app.get("/metrics")
+async def metrics():
+    """本进程内按命令名累计的执行统计（耗时、CPU、峰值内存、块 I/O），按 CPU 时间排序"""
+    return {"commands": command_metrics.snapshot()}
+
+
 @app.get("/local/tools")
 async def list_local_tools():
     """列出可用的本地工具及其状态"""
@@ -646,8 +3187,20 @@ async def list_local_tools():
 
 @app.post("/local/file/read")
 async def read_file(request: FileReadRequest):
-    """读取本地文件"""
+    """
+    读取本地文件
+    
+    raw=true 时直接返回文件字节（application/octet-stream），
+    不做 JSON 转义 / base64 二次拷贝
+    """
     try:
+        if request.raw:
+            data = fs.read_bytes(request.path, request.directory)
+            return Response(
+                content=data,
+                media_type="application/octet-stream",
+                headers={"X-File-Path": quote(request.path)},
+            )
         content = fs.read_file(request.path, request.directory, request.encoding)
         return {"path": request.path, "content": content}
     except FileNotFoundError:
@@ -670,7 +3223,9 @@ async def write_file(request: FileWriteRequest):
 async def search_files(request: FileSearchRequest):
     """搜索文件"""
     try:
-        files = fs.search_files(
+        # 在线程池中执行：不阻塞事件循环，相同的并发搜索也能合并
+        files = await asyncio.to_thread(
+            fs.search_files,
             request.directory or os.getcwd(),
             request.pattern,
             request.include,
@@ -685,7 +3240,7 @@ async def search_files(request: FileSearchRequest):
 async def list_files(directory: str, pattern: str = "*", recursive: bool = True):
     """列出目录文件"""
     try:
-        files = fs.list_files(directory, pattern, recursive)
+        files = await asyncio.to_thread(fs.list_files, directory, pattern, recursive)
         return {"files": files, "count": len(files)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -704,9 +3259,14 @@ async def search_knowledge(query: str, category: str = "all", limit: int = 5):
 async def manage_session(action: str, session_id: str = None, name: str = None):
     """管理会话"""
     if action == "create":
-        return {"session_id": str(uuid.uuid4()), "name": name, "status": "created"}
+        session_id = str(uuid.uuid4())
+        store.create_session(session_id, name)
+        return {"session_id": session_id, "name": name, "status": "created"}
     elif action == "list":
-        return {"sessions": []}
+        return {"sessions": store.list_sessions()}
+    elif action == "delete":
+        store.delete_session(session_id)
+        return {"session_id": session_id, "status": "deleted"}
     else:
         return {"session_id": session_id, "status": f"{action}d"}
 
@@ -720,18 +3280,86 @@ async def orchestrate_subagents(task: str, strategy: str = "auto", agents: list
 
 # ============ 启动服务 ============
 
+def bind_unix_socket(path: str) -> socket.socket:
+    """
+    创建 Unix domain socket 监听
+    
+    socket 文件权限为 0600，只有当前用户能连接（代替 TCP 端口的访问控制）
+    """
+    import stat
+    
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    
+    # 清理上次异常退出残留的 socket 文件（仍有服务监听则报错）；
+    # 路径来自命令行 / 环境变量，不是 socket 的文件（含符号链接）一律不删
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        mode = None
+    if mode is not None:
+        if not stat.S_ISSOCK(mode):
+            raise RuntimeError(f"Path exists and is not a socket: {path}")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            raise RuntimeError(f"Socket already in use: {path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            p.unlink(missing_ok=True)
+        finally:
+            probe.close()
+    
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # 先收紧 umask，避免 bind 到 chmod 之间的窗口期被他人连接
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+    return sock
+
+
 if __name__ == "__main__":
     import uvicorn
     import argparse
+    import multiprocessing
+    
+    # 打包版本多 worker 需要
+    multiprocessing.freeze_support()
     
     parser = argparse.ArgumentParser(description="My Agent Platform Server")
-    parser.add_argument("--host", default="0.0.0.0", help="Host to bind (default: 0.0.0.0)")
+    parser.add_argument("--host", default="127.0.0.1", help="Host to bind (default: 127.0.0.1)")
     parser.add_argument("--port", type=int, default=8000, help="Port to bind (default: 8000)")
+    parser.add_argument("--uds", default=None, help="Listen on a Unix domain socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1)")
     args = parser.parse_args()
     
+    if args.uds and not hasattr(socket, "AF_UNIX"):
+        parser.error("--uds is not supported on this platform")
+    
     print("启动扶摇 Agent 平台服务...")
     print(f"工作目录: {os.getcwd()}")
-    print(f"监听: http://{args.host}:{args.port}")
-    print(f"API 文档: http://localhost:{args.port}/docs")
+    if args.uds:
+        print(f"监听: unix:{args.uds}")
+    else:
+        print(f"监听: http://{args.host}:{args.port}")
+        print(f"API 文档: http://localhost:{args.port}/docs")
     
-    uvicorn.run(app, host=args.host, port=args.port)
+    # 监听参数：Unix socket 由本进程创建（控制权限），以 fd 交给 uvicorn
+    uds_sock = bind_unix_socket(args.uds) if args.uds else None
+    listen = {"fd": uds_sock.fileno()} if uds_sock else {"host": args.host, "port": args.port}
+    
+    try:
+        if args.workers > 1:
+            # worker 进程通过环境变量继承同一个状态库
+            os.environ["FUYAO_STATE_DB"] = STATE_DB_PATH
+            print(f"Workers: {args.workers} (共享状态: {STATE_DB_PATH})")
+            uvicorn.run("server:app", workers=args.workers, **listen)
+        else:
+            uvicorn.run(app, **listen)
+    finally:
+        # 被信号终止时可能来不及清理，残留文件由下次启动时清理
+        if uds_sock:
+            uds_sock.close()
+            Path(args.uds).unlink(missing_ok=True)
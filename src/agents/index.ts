@@ -150,7 +150,8 @@ export function createBridgeAgents(
  */
 export async function fetchAgentsFromPlatform(
   platformBaseUrl: string,
-  token: string
+  token: string,
+  platformSocket?: string
 ): Promise<Record<string, AgentConfig>> {
   try {
     const response = await fetch(`${platformBaseUrl}/agents`, {
@@ -158,7 +159,9 @@ export async function fetchAgentsFromPlatform(
         Authorization: `Bearer ${token}`,
         "Content-Type": "application/json",
       },
-    });
+      // Bun fetch 扩展：通过 Unix domain socket 访问
+      unix: platformSocket,
+    } as RequestInit);
 
     if (!response.ok) {
       console.warn("[Fuyao] 获取平台 agents 失败");
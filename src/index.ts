@@ -27,10 +27,12 @@ const FuyaoOpenCodePlugin: Plugin = async (ctx: PluginInput): Promise<Hooks> =>
   // 平台配置
   const platformBaseUrl = process.env.FUYAO_PLATFORM_URL || "http://localhost:8000";
   const platformToken = process.env.FUYAO_PLATFORM_TOKEN || "";
+  // 设置后通过 Unix domain socket 访问本地服务（python server.py --uds <path>）
+  const platformSocket = process.env.FUYAO_PLATFORM_SOCKET || undefined;
 
   // 创建 agents 和 tools
   const bridgeAgents = createBridgeAgents(ctx, platformBaseUrl);
-  const bridgeTools = createBridgeTools(ctx, platformBaseUrl, platformToken);
+  const bridgeTools = createBridgeTools(ctx, platformBaseUrl, platformToken, platformSocket);
   const mcpConfig = getMcpConfig(platformBaseUrl);
 
   // ============ 复用 oh-my-opencode 的 Hook 能力 ============
@@ -14,25 +14,44 @@ import type { PluginInput } from "@opencode-ai/plugin";
 export function createBridgeTools(
   ctx: PluginInput,
   platformBaseUrl: string,
-  platformToken: string
+  platformToken: string,
+  platformSocket?: string
 ) {
   // 通用 API 调用
+  // platformSocket: Unix domain socket 路径，设置后走本地 IPC（URL 中的 host 被忽略）
+  // context: 工具调用上下文；会话 ID 作为 X-Fuyao-Client 发送，服务端按会话分别限流
   async function callPlatformAPI(
     endpoint: string,
     method: "GET" | "POST" = "POST",
     body?: unknown,
-    signal?: AbortSignal
+    context?: { sessionID: string; abort: AbortSignal }
   ) {
     const url = endpoint.startsWith("http") ? endpoint : `${platformBaseUrl}${endpoint}`;
-    const response = await fetch(url, {
-      method,
-      headers: {
-        Authorization: `Bearer ${platformToken}`,
-        "Content-Type": "application/json",
-      },
-      body: body ? JSON.stringify(body) : undefined,
-      signal,
-    });
+    const signal = context?.abort;
+    let response: Response;
+    for (let attempt = 0; ; attempt++) {
+      response = await fetch(url, {
+        method,
+        headers: {
+          Authorization: `Bearer ${platformToken}`,
+          "Content-Type": "application/json",
+          ...(context?.sessionID ? { "X-Fuyao-Client": `opencode:${context.sessionID}` } : {}),
+        },
+        body: body ? JSON.stringify(body) : undefined,
+        signal,
+        // Bun fetch 扩展
+        unix: platformSocket,
+      } as RequestInit);
+
+      // 服务端限流（429 / 503 + Retry-After）：按提示等待后重试，最多 2 次
+      const retryAfter = Number(response.headers.get("retry-after"));
+      if ((response.status !== 429 && response.status !== 503) || !retryAfter || attempt >= 2) {
+        break;
+      }
+      await response.body?.cancel();
+      await new Promise((resolve) => setTimeout(resolve, Math.min(retryAfter, 10) * 1000));
+      signal?.throwIfAborted();
+    }
 
     if (!response.ok) {
       const text = await response.text();
@@ -69,7 +88,7 @@ Agent 运行在 Python SDK 上，可以：
           // 传递本地上下文给 Python
           directory: context.directory,
           worktree: context.worktree,
-        }, context.abort);
+        }, context);
 
         if (!args.wait_for_completion) {
           return `任务已提交 [${args.agent_id}]\nTask ID: ${result.task_id}`;
@@ -103,7 +122,7 @@ Skill 可以访问本地文件并执行本地工具。
           input: args.input,
           target_files: args.target_files,
           directory: context.directory,
-        }, context.abort);
+        }, context);
 
         return `## Skill [${args.skill}] 执行结果
 
@@ -139,10 +158,19 @@ ${result.output}`;
           args: args.args,
           directory: context.directory,
           timeout: args.timeout,
-        }, context.abort);
+        }, context);
 
         const output = [`## 命令执行结果`, ``, `**命令**: ${args.command} ${(args.args || []).join(" ")}`, `**退出码**: ${result.exit_code}`, `**耗时**: ${result.duration_ms}ms`];
 
+        if (result.rusage) {
+          const { user_ms, sys_ms, max_rss_kb } = result.rusage;
+          const rss = max_rss_kb ? `，峰值内存 ${Math.round(max_rss_kb / 1024)}MB` : "";
+          output.push(`**资源**: CPU ${user_ms + sys_ms}ms (user ${user_ms}ms / sys ${sys_ms}ms)${rss}`);
+        }
+        if (result.limit_exceeded) {
+          output.push(`**已终止**: 超出 ${result.limit_exceeded} 限制`);
+        }
+
         if (result.stdout) {
           output.push(``, `### stdout`, "```", result.stdout.trim(), "```");
         }
@@ -164,6 +192,8 @@ ${result.output}`;
 - Bun: bun-test, bun-build
 - Git: git-status, git-diff, git-log
 
+ruff、eslint、tsc、pytest 返回去重后的诊断列表（文件:行:列 级别 代码 信息），需要原始输出时传 options: { raw: true }。
+
 注意：如果工具未安装，会返回安装命令，你可以使用 Bash 工具执行安装后重试。`,
       args: {
         tool: tool.schema.string().describe("工具名称"),
@@ -176,7 +206,7 @@ ${result.output}`;
           target: args.target,
           directory: context.directory,
           options: args.options,
-        }, context.abort);
+        }, context);
 
         // 处理工具缺失的情况 - 返回 LLM 友好的提示
         if (result.tool_missing) {
@@ -235,7 +265,7 @@ ${result.output}`;
         const result = await callPlatformAPI("/local/file/read", "POST", {
           path: args.path,
           directory: context.directory,
-        }, context.abort);
+        }, context);
 
         return `## 文件: ${args.path}
 
@@ -264,7 +294,7 @@ ${result.content.slice(0, 5000)}
           path: args.path,
           content: args.content,
           directory: context.directory,
-        }, context.abort);
+        }, context);
 
         return `文件已写入: ${args.path} (${args.content.length} 字符)`;
       },
@@ -284,7 +314,7 @@ ${result.content.slice(0, 5000)}
           directory: context.directory,
           include: args.include,
           exclude: args.exclude,
-        }, context.abort);
+        }, context);
 
         if (result.count === 0) {
           return `未找到包含 "${args.pattern}" 的文件`;
@@ -307,7 +337,7 @@ ${result.files.slice(0, 20).map((f: string) => `- ${f}`).join("\n")}${result.cou
         limit: tool.schema.number().int().min(1).max(20).optional().default(5),
       },
       async execute(args, context) {
-        const result = await callPlatformAPI(`/knowledge/search?query=${encodeURIComponent(args.query)}&category=${args.category}&limit=${args.limit}`, "POST", undefined, context.abort);
+        const result = await callPlatformAPI(`/knowledge/search?query=${encodeURIComponent(args.query)}&category=${args.category}&limit=${args.limit}`, "POST", undefined, context);
 
         if (!result.items?.length) {
           return "未找到相关结果";
@@ -336,7 +366,7 @@ SubAgent 可以：
         const result = await callPlatformAPI(`/subagents/orchestrate?task=${encodeURIComponent(args.task)}&strategy=${args.strategy}`, "POST", {
           agents: args.agents,
           directory: context.directory,
-        }, context.abort);
+        }, context);
 
         return `## SubAgent 编排结果
 